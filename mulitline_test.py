@@ -5,54 +5,49 @@ Created on Tue Nov 08 13:49:24 2016
 @author: julia.delos
 """
 
+import os
+import sys
 import numpy as np
-from collections import defaultdict
 from scipy.stats import norm
 
-from bokeh.plotting import show, figure, output_file
-from bokeh.models import ColumnDataSource, HoverTool, TapTool
-from bokeh.layouts import gridplot
+from bokeh.plotting import show, output_file
 from bokeh.palettes import Viridis6
 
-mass_spec = defaultdict(list)
+# The plotting helpers live in the ploting folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ploting'))
+from ploting_lib import plotLinkedSpectra
 
-RT_x = np.linspace(118, 123, num=50)
+# The curves are downsampled to the plot width by plotLinkedSpectra, so they can
+# have many more points than pixels
+RT_x = np.linspace(118, 123, num=5000)
 norm_dist = norm(loc=120.4).pdf(RT_x)
 
-# Generate several gaussian distributions and spectral lines
-for scale, mz in [(1.0, 83), (0.9, 55), (0.6, 98), (0.4, 43), (0.2, 39), (0.12, 29)]:
-    mass_spec["RT"].append(RT_x)
-    mass_spec["RT_intensity"].append(norm_dist * scale)
-    mass_spec["MZ"].append([mz, mz])
-    mass_spec["MZ_intensity"].append([0, scale])
-    mass_spec['MZ_tip'].append(mz)
-    mass_spec['Intensity_tip'].append(scale)
+# Several gaussian distributions and spectral lines
+scale = np.array([1.0, 0.9, 0.6, 0.4, 0.2, 0.12])
+mz = np.array([83, 55, 98, 43, 39, 29], dtype=float)
+n_series = len(scale)
 
-mass_spec['color'] = Viridis6
+# The series are stored as ragged arrays: the values of all the series in a
+# flat array plus the offsets where each one starts
+rt = np.tile(RT_x, n_series)
+rt_int = (scale[:, None] * norm_dist).ravel()
+rt_offsets = np.arange(n_series + 1) * len(RT_x)
 
-source = ColumnDataSource(mass_spec)
+# Each spectral line goes from 0 to its intensity
+mz_vals = np.repeat(mz, 2)
+mz_int = np.c_[np.zeros(n_series), scale].ravel()
+mz_offsets = np.arange(n_series + 1) * 2
 
-figure_opts = dict(plot_width=450, plot_height=300)
-hover_opts = dict(
-    tooltips=[('MZ', '@MZ_tip'), ('Rel Intensity', '@Intensity_tip')],
-    show_arrow=False,
-    line_policy='next'
-)
 line_opts = dict(
     line_width=5, line_color='color', line_alpha=0.6,
     hover_line_color='color', hover_line_alpha=1.0,
-    source=source
 )
 
-rt_plot = figure(tools=[HoverTool(**hover_opts), TapTool()], **figure_opts)
-rt_plot.multi_line(xs='RT', ys='RT_intensity', legend="Intensity_tip", **line_opts)
-rt_plot.xaxis.axis_label = "Retention Time (sec)"
-rt_plot.yaxis.axis_label = "Intensity"
-
-mz_plot = figure(tools=[HoverTool(**hover_opts), TapTool()], **figure_opts)
-mz_plot.multi_line(xs='MZ', ys='MZ_intensity', legend="Intensity_tip", **line_opts)
-mz_plot.xaxis.axis_label = "MZ"
-mz_plot.yaxis.axis_label = "Intensity"
+plots = plotLinkedSpectra(rt, rt_int, rt_offsets, mz_vals, mz_int, mz_offsets,
+                          data={'MZ_tip': mz, 'Intensity_tip': scale,
+                                'color': list(Viridis6)},
+                          tooltips=[('MZ', '@MZ_tip'), ('Rel Intensity', '@Intensity_tip')],
+                          webgl=True, legend="Intensity_tip", **line_opts)
 
 output_file("test.html")
-show(gridplot([[rt_plot, mz_plot]]))
\ No newline at end of file
+show(plots)
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite of the box parameter strategies of boxParms.boxPerKey,
+self-contained and running on local[*].
+
+A synthetic (key, value) data set is generated with a configurable number of
+keys, rows per key and skew: the keys follow a Zipf distribution of exponent
+--skew (0 means all the keys have the same number of rows). The values are
+log-normal, so each key has a long tail of outliners.
+
+For each strategy it reports:
+    time     --> Wall clock time to compute and collect the result.
+    shuffle  --> Shuffle bytes written by the jobs of the strategy, read from
+                 the spark monitoring REST api.
+    driver   --> Peak memory allocated by the python driver (tracemalloc).
+    error    --> Maximum error of Q1, Q2, Q3, Qmin and Qmax against the exact
+                 boxParams result ('group' mode), relative to the IQR of the key.
+
+With --transfer the RDD path, where every Row is pickled into the python
+workers, is compared with the columnar path ('pandas' mode), where the values
+are transferred with Arrow, moving the data with functions doing nothing.
+
+Run this example by executing this line:
+    spark-submit benchBoxPerKey.py --keys 100 --rows 10000 --skew 1.2
+
+@author: julia.delos
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import time
+import tracemalloc
+
+import numpy as np
+from pyspark.sql import SparkSession
+
+try:
+    from urllib.request import urlopen
+except ImportError:
+    from urllib2 import urlopen
+
+from boxParms import boxPerKey
+
+#Strategies benchmarked: label --> boxPerKey keyword arguments
+strategies = [
+    ('filter', dict(mode='filter')),
+    ('group', dict(mode='group')),
+    ('kernel', dict(mode='kernel')),
+    ('pandas', dict(mode='pandas')),
+    ('sketch', dict(mode='sketch')),
+    ('group+skew', dict(mode='group', skew=True)),
+    ('kernel+skew', dict(mode='kernel', skew=True)),
+    ('pandas+skew', dict(mode='pandas', skew=True)),
+    ('exact', dict(mode='exact')),
+    ('sql', dict(mode='sql')),
+    ('sql-exact', dict(mode='sql', rankErr=None)),
+]
+
+
+def genData(spark, n_keys, rows_per_key, skew, n_parts, seed=25):
+    """
+    Returns a cached data frame [key: string, val: double] with
+    n_keys*rows_per_key rows. Each partition is generated in the executors
+    with its own seed.
+    """
+    n_rows = n_keys * rows_per_key
+    ranks = np.arange(1, n_keys + 1, dtype=float)
+    prob = ranks ** -skew
+    prob /= prob.sum()
+
+    def genPart(idx):
+        rng = np.random.RandomState(seed + idx)
+        size = n_rows // n_parts + (1 if idx < n_rows % n_parts else 0)
+        keys = rng.choice(n_keys, size=size, p=prob)
+        vals = rng.lognormal(7, 0.5, size=size)
+        return [('k%05d' % k, float(v)) for k, v in zip(keys, vals)]
+
+    df = spark.sparkContext.parallelize(range(n_parts), n_parts).flatMap(
+              genPart).toDF(['key', 'val']).cache()
+    df.count()
+    return df
+
+
+def shuffleBytes(sc, group):
+    # Sum of the shuffle write bytes of all the stages of the job group
+    url = '%s/api/v1/applications/%s/stages/' % (sc.uiWebUrl, sc.applicationId)
+    total = 0
+    for job in sc.statusTracker().getJobIdsForGroup(group):
+        info = sc.statusTracker().getJobInfo(job)
+        for stage in (info.stageIds if info else []):
+            for attempt in json.loads(urlopen(url + str(stage)).read().decode()):
+                total += attempt.get('shuffleWriteBytes', 0)
+    return total
+
+
+def maxError(res, ref):
+    # Largest error of the box parameters relative to the IQR of each key
+    cols = ['Q1', 'Q2', 'Q3', 'Qmin', 'Qmax']
+    err = 0.0
+    for key, r in ref.items():
+        q = res[key]
+        scale = r['IQR'] if r['IQR'] > 0 else 1.0
+        err = max(err, max(abs(q[c] - r[c]) / scale for c in cols))
+    return err
+
+
+def runStrategy(sc, df, label, kwargs):
+    sc.setJobGroup(label, label)
+    tracemalloc.start()
+    t0 = time.time()
+    rows = boxPerKey(df, 0, 1, **kwargs).collect()
+    dt = time.time() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return rows, dt, shuffleBytes(sc, label), peak
+
+
+def transferRdd(df):
+    # Every Row is pickled to the python worker and a value pickled back
+    return df.rdd.map(lambda x: (x[0], x[1])).groupByKey().map(
+              lambda kv: kv[0]).count()
+
+
+def transferArrow(df):
+    # The groups are transferred as Arrow batches, one row returned per key
+    def first(pdf):
+        return pdf.head(1)
+    grouped = df.groupBy('key')
+    if hasattr(grouped, 'applyInPandas'):
+        return grouped.applyInPandas(first, df.schema).count()
+    from pyspark.sql.functions import pandas_udf, PandasUDFType
+    return grouped.apply(
+              pandas_udf(first, df.schema, PandasUDFType.GROUPED_MAP)).count()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="boxPerKey benchmark suite")
+    parser.add_argument('--keys', type=int, default=100, help="number of keys")
+    parser.add_argument('--rows', type=int, default=10000,
+                        help="average number of rows per key")
+    parser.add_argument('--skew', type=float, default=0.0,
+                        help="Zipf exponent of the key distribution")
+    parser.add_argument('--partitions', type=int, default=8)
+    parser.add_argument('--modes', default=None,
+                        help="comma separated list of strategies, default all "
+                             "but 'filter'")
+    parser.add_argument('--transfer', action='store_true',
+                        help="also compare the pickle and Arrow transfer")
+    args = parser.parse_args()
+
+    spark = SparkSession.builder.master("local[*]").appName(
+              "BenchBoxPerKey").getOrCreate()
+    sc = spark.sparkContext
+    sc.setLogLevel('ERROR')
+
+    df = genData(spark, args.keys, args.rows, args.skew, args.partitions)
+    print("Keys: %d, rows per key: %d, skew: %.2f" % (args.keys, args.rows, args.skew))
+
+    if args.transfer:
+        t0 = time.time()
+        transferRdd(df)
+        t_rdd = time.time() - t0
+        t0 = time.time()
+        transferArrow(df)
+        t_arw = time.time() - t0
+        print("Transfer rdd (pickle): %.2f s, pandas (arrow): %.2f s, speed up %.1fx"
+              % (t_rdd, t_arw, t_rdd / t_arw))
+
+    selected = args.modes.split(',') if args.modes else [
+              s for s, _ in strategies if s != 'filter']
+    # The exact result of boxParams, used to check the accuracy
+    ref = dict((r['key'], r.asDict()) for r in boxPerKey(df, 0, 1, mode='group').collect())
+
+    print("%-12s %9s %12s %12s %10s" % ('strategy', 'time [s]', 'shuffle [MB]',
+                                         'driver [MB]', 'error'))
+    for label, kwargs in strategies:
+        if label not in selected:
+            continue
+        rows, dt, shf, peak = runStrategy(sc, df, label, kwargs)
+        err = maxError(dict((r['key'], r.asDict()) for r in rows), ref)
+        print("%-12s %9.2f %12.2f %12.2f %10.2e" % (label, dt, shf / 2.0**20,
+                                                     peak / 2.0**20, err))
+    spark.stop()
@@ -7,12 +7,21 @@ The box plot paramters are computed by grouping the values of the input
 spark dataframe by key.
 
 The operation is rather slow since it needs to collect the values in memory to use the numpy percentile
-functions.
+functions. The 'group' mode of boxPerKey does it in a single distributed pass,
+keeping the values of each key in the executors.
 
 
 @author: julia.delos
 """
+import heapq
+import random
+import time
+from datetime import datetime
 import numpy as np
+from quantileSketch import TDigest, compressionForError
+
+#Names of the columns returned by boxParams, in the same order
+boxCols = ['Q1','Q2','Q3','IQR','Qmax','Qmin','OL']
 
 #Compute box parameters using numpy
 def boxParams(v):
@@ -30,24 +39,532 @@ def boxParams(v):
          Qmax --> Maximum value of the dataset without the outliners
          OL   --> List the list of otuliners (if there are any).
 
+        The values are converted to float, so the result matches the double
+        columns of boxSchema also for integer measures. Qmin and Qmax are nan
+        when no value lies inside the whiskers.
     """
-    v = np.array(v)
+    v = np.asarray(v, dtype=float)
     Q1 = float(np.percentile(v,25))
     Q3 = float(np.percentile(v,75))
     Q2 = float(np.median(v))
     IQR = Q3 - Q1
     vCl =  v[(v>Q1-1.5*IQR) & (v<Q3+1.5*IQR)]
     OL = v[(v<Q1-1.5*IQR) | (v>Q3+1.5*IQR)]
-    Qmax = float(np.max(vCl))
-    Qmin = float(np.min(vCl))
+    #With IQR 0 (e.g. a constant key) no value lies inside the whiskers
+    Qmax = float(np.max(vCl)) if vCl.size else float('nan')
+    Qmin = float(np.min(vCl)) if vCl.size else float('nan')
     return [Q1,Q2,Q3,IQR,Qmax,Qmin,OL.tolist()]
 
-def boxPerKey(df,keyCol,valCol):
+def boxParamsGrouped(keys,v):
+    """
+        Compute the box plot parameters of every key at once. keys and v
+        are two sequences of the same length with the key and the value of
+        each measure.
+
+        The values are sorted once by (key, value) and the quartiles,
+        whiskers and outliners of all the keys are computed with vectorised
+        numpy indexing over the key segments, avoiding the python overhead
+        of calling boxParams for each key.
+
+        Returns a list of rows [key,Q1,Q2,Q3,IQR,Qmax,Qmin,OL], one for each
+        key, with the same values as boxParams. The outliners are returned
+        sorted. Qmin and Qmax are nan when no value lies inside the whiskers.
+    """
+    v = np.asarray(v, dtype=float)
+    if isinstance(keys[0], tuple):
+        # Composed keys (e.g. key and metric) are compared as python tuples
+        kArr = np.empty(len(keys), dtype=object)
+        kArr[:] = keys
+    else:
+        kArr = np.asarray(keys)
+    uKeys, codes = np.unique(kArr, return_inverse=True)
+    #Single sort, first by key and then by value
+    order = np.lexsort((v, codes))
+    v = v[order]
+    codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    ends = np.r_[starts[1:], v.size]
+    cnt = ends - starts
+
+    def quantile(p):
+        # Linear interpolation between ranks as in numpy.percentile
+        pos = starts + (cnt - 1) * p
+        i0 = np.floor(pos).astype(int)
+        i1 = np.minimum(i0 + 1, ends - 1)
+        return v[i0] + (v[i1] - v[i0]) * (pos - i0)
+
+    Q1 = quantile(0.25)
+    Q2 = quantile(0.5)
+    Q3 = quantile(0.75)
+    IQR = Q3 - Q1
+    lo = np.repeat(Q1 - 1.5*IQR, cnt)
+    hi = np.repeat(Q3 + 1.5*IQR, cnt)
+    #Since each segment is sorted, the values below the bottom whisker are
+    # a prefix of the segment and the ones above the top whisker a suffix.
+    nBelow = np.add.reduceat(v < lo, starts)
+    nNotAbove = np.add.reduceat(v <= hi, starts)
+    iMin = starts + np.add.reduceat(v <= lo, starts)
+    iMax = starts + np.add.reduceat(v < hi, starts) - 1
+    valid = (iMin <= iMax)
+    Qmin = np.where(valid, v[np.minimum(iMin, ends - 1)], np.nan)
+    Qmax = np.where(valid, v[np.maximum(iMax, starts)], np.nan)
+    isOL = (v < lo) | (v > hi)
+    OL = np.split(v[isOL], np.cumsum(nBelow + cnt - nNotAbove)[:-1])
+    return [[k, q1, q2, q3, iqr, qmax, qmin, ol.tolist()]
+            for k, q1, q2, q3, iqr, qmax, qmin, ol in
+            zip(uKeys.tolist(), Q1.tolist(), Q2.tolist(), Q3.tolist(),
+                IQR.tolist(), Qmax.tolist(), Qmin.tolist(), OL)]
+
+
+def compactOutliers(OL,olKeep,olSample=0):
+    """
+        Bounds the size of the outliners list OL. It keeps:
+            the olKeep smallest and the olKeep largest outliners and
+            a random sample (without replacement) of olSample outliners
+            among the remaining ones.
+        The values are returned as a float32 numpy array, together with
+        the total number of outliners.
+    """
+    OL = np.sort(np.asarray(OL, dtype=np.float32))
+    nOL = OL.size
+    if nOL <= 2*olKeep + olSample:
+        return OL, nOL
+    middle = OL[olKeep:nOL-olKeep]
+    # random is reseeded in each forked python worker, numpy is not
+    sample = np.sort(middle[random.sample(range(middle.size), olSample)])
+    return np.concatenate((OL[:olKeep], sample, OL[nOL-olKeep:])), nOL
+
+
+def compactRow(row,olKeep,olSample=0,nOL=None):
+    """
+        Applies compactOutliers to the outliners of a boxPerKey row
+        [key,Q1,...,OL]. Returns the row with the compacted outliners and
+        their total number appended. nOL overrides the total number of
+        outliners, used when OL is already truncated (sketch mode).
+    """
+    OL, n = compactOutliers(row[-1], olKeep, olSample)
+    return row[:-1] + [OL.tolist(), int(n if nOL is None else nOL)]
+
+
+def outlierSummary(v):
+    """
+        Mergeable summary of the single outliner v, used to apply the
+        compactOutliers policy to partial aggregations: (lowest, highest,
+        keyed) lists of (value, random key) items. See mergeOutliers.
+    """
+    # random is reseeded in each forked python worker, numpy is not
+    item = (v, random.random())
+    return ([item], [item], [item])
+
+
+def mergeOutliers(a,b,olKeep,olSample=0):
+    """
+        Merges two outliner summaries keeping the olKeep lowest and the olKeep
+        highest items and the 2*olKeep+olSample items with the smallest random
+        keys. The items with the smallest keys are a uniform sample of all the
+        merged outliners whatever the sizes of the partial summaries, so no
+        weighting of the partial samples is needed.
+    """
+    return (heapq.nsmallest(olKeep, a[0] + b[0]),
+            heapq.nlargest(olKeep, a[1] + b[1]),
+            heapq.nsmallest(2*olKeep + olSample, a[2] + b[2], key=lambda x: x[1]))
+
+
+def summaryOutliers(summary,nOL,olKeep,olSample=0):
+    """
+        Returns the sorted outliners list of a summary of nOL outliners, as
+        compactOutliers would: all of them if there are at most
+        2*olKeep+olSample, otherwise the olKeep extremes and the olSample
+        items with the smallest keys among the rest.
+    """
+    low, high, keyed = summary
+    if nOL <= 2*olKeep + olSample:
+        return sorted(v for v, _ in keyed)
+    extremes = set(low + high)
+    sample = [x for x in keyed if x not in extremes][:olSample]
+    return sorted(v for v, _ in low + sample + high)
+
+
+def boxPartition(pairs):
+    """
+        Runs boxParamsGrouped over an iterator of (key,value) pairs, used
+        with mapPartitions once all the values of a key are in the same
+        partition.
+    """
+    pairs = list(pairs)
+    if not pairs:
+        return []
+    keys, vals = zip(*pairs)
+    return boxParamsGrouped(keys, vals)
+
+
+def boxFrame(pdf,olKeep=None,olSample=0):
+    """
+        Grouped map function used by the 'pandas' mode of boxPerKey. pdf is
+        a pandas data frame with the key and the values of a single key, the
+        values are passed to boxParams as a contiguous numpy array.
+        The values are in the last column, the previous ones are the key
+        columns (e.g. key and metric).
+    """
+    import pandas as pd
+    row = pdf.iloc[0,:-1].tolist() + boxParams(pdf.iloc[:,-1].values)
+    if olKeep is not None:
+        row = compactRow(row,olKeep,olSample)
+    return pd.DataFrame([row])
+
+
+def boxParamsSketch(d):
+    """
+        Compute the parameters of a box plot from the TDigest d. It returns
+        the same list as boxParams but the values are approximated:
+         Q1, Q2, Q3 --> Estimated from the digest centroids.
+         Qmin, Qmax --> Exact when they are among the extremes kept by the
+                        digest, otherwise the closest centroid inside the
+                        whiskers.
+         OL         --> Only the outliners among the extremes kept by the
+                        digest, the list is truncated to d.nExt values on
+                        each side.
+    """
+    Q1, Q2, Q3 = [float(q) for q in d.quantile([0.25,0.5,0.75])]
+    IQR = Q3 - Q1
+    lo = Q1 - 1.5*IQR
+    hi = Q3 + 1.5*IQR
+    #Centroids inside the whiskers, used when the extremes are not enough
+    inMeans = d.means[(d.means > lo) & (d.means < hi)]
+    if d.vmin > lo:
+        Qmin = d.vmin
+    elif np.any(d.low > lo):
+        Qmin = d.low[d.low > lo][0]
+    else:
+        Qmin = inMeans[0] if inMeans.size else Q1
+    if d.vmax < hi:
+        Qmax = d.vmax
+    elif np.any(d.high < hi):
+        Qmax = d.high[d.high < hi][-1]
+    else:
+        Qmax = inMeans[-1] if inMeans.size else Q3
+    OL = np.concatenate((d.low[d.low < lo], d.high[d.high > hi]))
+    return [Q1,Q2,Q3,IQR,float(Qmax),float(Qmin),OL.tolist()]
+
+
+def sketchOutlierCount(d,Q1,Q3):
+    """
+        Estimated number of outliners of the values summarised by the TDigest
+        d, given its quartiles Q1 and Q3.
+    """
+    IQR = Q3 - Q1
+    return int(d.rank(Q1 - 1.5*IQR) + d.n - d.rank(Q3 + 1.5*IQR))
+
+
+#Named bucket widths, in seconds
+bucketWidths = {'minute': 60, 'hour': 3600, 'day': 86400, 'week': 604800}
+
+
+def timeBucket(t,width):
+    """
+    Returns the label of the time bucket of width seconds that contains the
+    time t. t can be a datetime (as returned by spark for timestamp columns)
+    or the number of seconds since epoch. The buckets are aligned to epoch
+    and labeled with their start in local time as 'YYYY-MM-DD HH:MM', hence
+    the labels sort in chronological order.
+    """
+    if isinstance(t, datetime):
+        t = time.mktime(t.timetuple()) + t.microsecond * 1e-6
+    start = datetime.fromtimestamp(t - t % width)
+    return start.strftime('%Y-%m-%d %H:%M')
+
+
+def heavyKeys(rddKeyValue,fraction=0.01,numPartitions=None):
+    """
+    Detects the keys with too many values for a single task. The key
+    counts are estimated from a sample of the (key,value) pairs rddKeyValue
+    (fraction of the pairs) and the keys with more values than the average
+    load of a partition are returned as a set.
+    """
+    if numPartitions is None:
+        numPartitions = rddKeyValue.getNumPartitions()
+    counts = rddKeyValue.sample(False,fraction,25).countByKey()
+    total = sum(counts.values())
+    return set(k for k, c in counts.items() if c > total / float(numPartitions))
+
+
+def boxExact(rddKeyValue,olKeep=None,olSample=0,numPartitions=None):
+    """
+    Computes the exact box plot parameters of the (key,value) pairs
+    rddKeyValue without collecting the values of a key in a single task or
+    in the driver:
+        1. The number of values of each key is counted.
+        2. The pairs are sorted by (key, value) across the cluster, so a big
+           key is spread over several partitions, and each pair gets its
+           global rank. The driver knows where each key starts in the sorted
+           data, hence the ranks of the values needed to interpolate Q1, Q2
+           and Q3 (same as numpy.percentile). Only those values are collected.
+        3. A second pass aggregates per key the whiskers (min and max inside
+           the IQR fences) and the outliners.
+    The driver only holds a few values per key. The outliners of a key are
+    gathered in a single task, use olKeep to bound them (see compactOutliers).
+    The partial aggregations then only carry a bounded summary of the
+    outliners (see mergeOutliers), the sample is the same as if it were taken
+    from the whole list.
+
+    Returns an rdd of rows [key,Q1,Q2,Q3,IQR,Qmax,Qmin,OL] (plus OLn if
+    olKeep is not None).
+    """
+    from pyspark import StorageLevel
+    sc = rddKeyValue.context
+    rddKeyValue = rddKeyValue.filter(lambda kv: kv[1] is not None).mapValues(float)
+    # Read by the count, the sample and the map stage of the sort and the
+    # last aggregation, the source is only scanned once
+    rddKeyValue.persist(StorageLevel.MEMORY_AND_DISK)
+    counts = rddKeyValue.countByKey()
+
+    # Global rank of the first value of each key in the sorted data and the
+    # ranks needed to interpolate the quartiles
+    starts = {}
+    need = {}
+    start = 0
+    for key in sorted(counts):
+        n = counts[key]
+        starts[key] = start
+        for p in (0.25,0.5,0.75):
+            i0 = int(np.floor((n - 1) * p))
+            need[start + i0] = key
+            need[start + min(i0 + 1, n - 1)] = key
+        start += n
+    need = sc.broadcast(need)
+
+    ranked = rddKeyValue.map(lambda kv: (kv, None)).sortByKey(
+              numPartitions=numPartitions).keys().zipWithIndex()
+    picked = dict(ranked.filter(lambda x: x[1] in need.value).map(
+              lambda x: (x[1], x[0][1])).collect())
+    need.unpersist()
+
+    quart = {}
+    for key, n in counts.items():
+        def at(p):
+            pos = (n - 1) * p
+            i0 = int(np.floor(pos))
+            a = picked[starts[key] + i0]
+            b = picked[starts[key] + min(i0 + 1, n - 1)]
+            return a + (b - a) * (pos - i0)
+        Q1, Q2, Q3 = at(0.25), at(0.5), at(0.75)
+        quart[key] = (Q1, Q2, Q3, Q3 - Q1)
+    quart = sc.broadcast(quart)
+
+    def partial(kv):
+        # (min inside, max inside, outliners, number of outliners)
+        Q1, Q2, Q3, IQR = quart.value[kv[0]]
+        v = kv[1]
+        if Q1 - 1.5*IQR < v < Q3 + 1.5*IQR:
+            return (kv[0], (v, v, [] if olKeep is None else ([], [], []), 0))
+        if v < Q1 - 1.5*IQR or v > Q3 + 1.5*IQR:
+            return (kv[0], (np.inf, -np.inf, [v] if olKeep is None else outlierSummary(v), 1))
+        return (kv[0], (np.inf, -np.inf, [] if olKeep is None else ([], [], []), 0))
+
+    def merge(a, b):
+        if olKeep is None:
+            OL = a[2]
+            OL.extend(b[2])
+        else:
+            OL = mergeOutliers(a[2], b[2], olKeep, olSample)
+        return (min(a[0], b[0]), max(a[1], b[1]), OL, a[3] + b[3])
+
+    def boxRow(kv):
+        Q1, Q2, Q3, IQR = quart.value[kv[0]]
+        Qmin, Qmax, OL, nOL = kv[1]
+        if olKeep is not None:
+            OL = summaryOutliers(OL, nOL, olKeep, olSample)
+        row = [kv[0], Q1, Q2, Q3, IQR,
+               float(Qmax) if Qmax > -np.inf else float('nan'),
+               float(Qmin) if Qmin < np.inf else float('nan'), OL]
+        if olKeep is None:
+            return row
+        return compactRow(row, olKeep, olSample, nOL)
+
+    # The rows (one per key) are materialized so the values can be released
+    rows = rddKeyValue.map(partial).reduceByKey(merge).map(boxRow)
+    rows.persist(StorageLevel.MEMORY_AND_DISK)
+    rows.count()
+    rddKeyValue.unpersist()
+    quart.unpersist()
+    return rows
+
+
+def colIndex(df,col):
+    """Returns the index of the column col of df, given by index or name."""
+    if isinstance(col,int):
+        return col
+    return df.columns.index(col)
+
+
+def boxSql(sdf,keyNames,rankErr=0.01,olKeep=None,olSample=0):
+    """
+    Computes the box plot parameters with spark sql aggregates only, so the
+    data never leaves the JVM. sdf is a data frame with the key columns
+    keyNames and the values in the column 'val'.
+
+    The quartiles are computed with percentile_approx, with a relative error
+    rankErr, or with the exact percentile when rankErr is None (same linear
+    interpolation as numpy). The whiskers and the outliners are computed by
+    a second conditional aggregation over the IQR fences.
+
+    Returns a data frame with the columns keyNames followed by Q1, Q2, Q3,
+    IQR, Qmax, Qmin, OL and, if olKeep is not None, OLn (same outliners
+    policy as compactOutliers).
+    """
+    from pyspark.sql import functions as F
+    if rankErr is None:
+        pct = "percentile(val, array(0.25, 0.5, 0.75))"
+    else:
+        pct = "percentile_approx(val, array(0.25, 0.5, 0.75), %d)" % int(
+                  np.ceil(1.0/rankErr))
+    q = sdf.groupBy(*keyNames).agg(F.expr(pct).alias('q')).select(
+              *(keyNames + [F.col('q')[i].alias(c)
+                            for i, c in enumerate(['Q1','Q2','Q3'])]))
+    q = q.withColumn('IQR', F.col('Q3') - F.col('Q1'))
+    val = F.col('val')
+    lo = F.col('Q1') - 1.5*F.col('IQR')
+    hi = F.col('Q3') + 1.5*F.col('IQR')
+    box = sdf.join(q, keyNames).groupBy(*(keyNames + ['Q1','Q2','Q3','IQR'])).agg(
+              F.max(F.when((val > lo) & (val < hi), val)).alias('Qmax'),
+              F.min(F.when((val > lo) & (val < hi), val)).alias('Qmin'),
+              F.collect_list(F.when((val < lo) | (val > hi), val)).alias('OL'))
+    if olKeep is None:
+        return box
+    # Keep the olKeep extremes and a random sample of olSample of the rest
+    box = box.withColumn('OL', F.sort_array('OL')).withColumn(
+              'OLn', F.size('OL').cast('long'))
+    compact = ("concat(slice(OL, 1, {K}), "
+               "sort_array(slice(shuffle(slice(OL, {K} + 1, OLn - 2*{K})), 1, {S})), "
+               "slice(OL, OLn - {K} + 1, {K}))").format(K=olKeep, S=olSample)
+    return box.withColumn('OL', F.when(F.col('OLn') <= 2*olKeep + olSample, F.col('OL'))
+                                 .otherwise(F.expr(compact))
+                                 .cast('array<float>'))
+
+
+def boxWide(res,metrics):
+    """
+    Pivots the long format result of boxPerKey (key,metric,Q1,...) into the
+    wide format, with one row per key (and bucket) and the columns <metric>_Q1,
+    <metric>_Q2 ... for each metric in the list metrics.
+    """
+    from pyspark.sql import functions as F
+    ids = [c for c in ('key','bucket') if c in res.columns]
+    cols = [c for c in res.columns if c not in ids + ['metric']]
+    return res.groupBy(*ids).pivot('metric',metrics).agg(
+              *[F.first(c).alias(c) for c in cols])
+
+
+def boxSchema(df,keyCol,olKeep=None,metric=False,bucket=False):
+    """
+    Returns the schema of the data frame generated by boxPerKey. The key
+    column inherits its type from the column keyCol of the data frame df.
+    Giving the schema explicitly avoids that spark has to infer the types
+    from the data, which fails when the first outliners lists are empty.
+    When an outliners policy is used (olKeep not None) OL is stored as
+    array<float> and the column OLn with the total number of outliners is
+    added. With bucket=True and metric=True the string columns 'bucket' and
+    'metric' are added after the key, in this order.
+    """
+    from pyspark.sql.types import (StructType, StructField, DoubleType,
+                                   FloatType, LongType, ArrayType, StringType)
+    keyType = df.schema.fields[keyCol].dataType
+    fields = [StructField('key',keyType)]
+    if bucket:
+        fields.append(StructField('bucket',StringType()))
+    if metric:
+        fields.append(StructField('metric',StringType()))
+    fields += [StructField(c,DoubleType()) for c in boxCols[:-1]]
+    if olKeep is None:
+        return StructType(fields + [StructField('OL',ArrayType(DoubleType()))])
+    return StructType(fields + [StructField('OL',ArrayType(FloatType())),
+                                StructField('OLn',LongType())])
+
+
+def boxPerKey(df,keyCol,valCol,mode='filter',rankErr=0.01,numPartitions=None,
+              olKeep=None,olSample=0,skew=False,sampleFrac=0.01,wide=False,
+              timeCol=None,bucket='hour'):
     """
     This function computes the box plot paramters from the data frame df,
      given that
-        keyCol is the column index for the keys and
-        valCol is the column index for the values.
+        keyCol is the column index (or name) for the keys and
+        valCol is the column index (or name) for the values.
+
+    valCol can also be a list of column indexes or names. In this case the box
+    parameters of all the value columns (metrics) are computed reading the
+    data once and with a single shuffle. The result has a 'metric' column,
+    with the name of the value column, after the key (long format). With
+    wide=True the result has a row per key and the box parameters of each
+    metric in the columns <metric>_Q1, <metric>_Q2 ... (see boxWide).
+
+    timeCol is the column index of a timestamp (or seconds since epoch)
+    column. When given, the box parameters are computed for each key and
+    time bucket in the same distributed aggregation, and the string column
+    'bucket' with the bucket start (see timeBucket) is added after the key.
+    bucket is the width of the buckets in seconds or one of 'minute',
+    'hour', 'day' or 'week'. The result of a key can be passed directly to
+    plotBoxPlot using the buckets as categories:
+        pdf = boxPerKey(df,0,1,mode='group',timeCol=2,bucket='day').filter(
+                  "key = 'PAK'").orderBy('bucket').toPandas()
+        p = plotBoxPlot(pdf.bucket.tolist(),pdf.Q1.tolist(),pdf.Q2.tolist(),
+                        pdf.Q3.tolist(),pdf.Qmin.tolist(),pdf.Qmax.tolist(),
+                        pdf.OL.tolist())
+
+    The computation strategy is selected with the mode argument:
+        'filter' --> Collects the list of keys and runs one spark job per key
+                     collecting its values to the driver (default).
+                     Only usable for a small number of keys.
+        'group'  --> Single distributed pass. The values are grouped by key
+                     on the executors and boxParams is computed there, so
+                     only the box parameters reach the driver.
+        'kernel' --> Single distributed pass. The pairs are hash partitioned
+                     by key and each partition is processed at once with the
+                     vectorised boxParamsGrouped. Faster than 'group' when
+                     there are many small keys.
+        'pandas' --> Single distributed pass using a grouped map pandas udf.
+                     The values are transferred to python in columnar format
+                     (Arrow) instead of pickling each Row. Needs spark >= 2.3
+                     with pandas and pyarrow installed in the workers.
+        'sketch' --> Approximated box parameters. A TDigest is built per key
+                     in each partition and the digests are merged, the memory
+                     used per key does not grow with the number of values.
+                     See boxParamsSketch.
+        'exact'  --> Exact box parameters without collecting the values of a
+                     key in a task: the pairs are sorted across the cluster
+                     and the values at the quartile ranks are picked, then a
+                     second pass computes whiskers and outliners. Keys with
+                     billions of values are split among several tasks.
+                     See boxExact.
+        'sql'    --> Only spark sql aggregates, computed in the JVM without
+                     python workers: percentile_approx (or percentile when
+                     rankErr is None) for the quartiles and a second
+                     conditional aggregation for the whiskers and outliners.
+                     See boxSql.
+
+    numPartitions is the number of partitions used by the 'kernel' and
+    'exact' modes to distribute the keys. Default: the number of partitions of df.
+
+    rankErr is the error bound of the quartiles in the 'sketch' and 'sql'
+    modes, given as a fraction of the number of values of the key.
+    Default 0.01 (1%). In the 'sql' mode None computes the exact quartiles.
+
+    skew enables the skew handling of the 'group', 'kernel' and 'pandas'
+    modes, which gather all the values of a key in a single task. The heavy
+    keys are detected from a sample of sampleFrac of the rows (see heavyKeys)
+    and computed with boxExact, which spreads a key over several sorted
+    partitions, the rest of the keys with the selected mode. The results are
+    still exact and a hot key does not leave a single straggler task.
+    Default False. The 'sketch' mode builds the digests on the map side and
+    does not need it.
+
+    olKeep and olSample define the outliners policy. By default (olKeep None)
+    all the outliners are returned. Otherwise OL only keeps the olKeep
+    smallest and largest outliners plus a random sample of olSample of the
+    rest, stored as float32, and the column OLn with the total number of
+    outliners is added (estimated in the 'sketch' mode). See compactOutliers.
+    In the 'sketch' mode the digests only keep the most extreme values, so
+    the sample is drawn among them and is not uniform among all the
+    outliners but biased towards the tails.
 
     The function retursn a spark dataframe with the following schema:
         DataFrame[key: [type inherited from the key],
@@ -66,30 +583,174 @@ def boxPerKey(df,keyCol,valCol):
         app_str is the key, hence column index 0
         pm is the value, hence column index 1
     """
+    #Columns can be given by name or index
+    keyCol = colIndex(df,keyCol)
+    if timeCol is not None:
+        timeCol = colIndex(df,timeCol)
+    #Several value columns are handled as a single one keyed by (key,metric)
+    multi = isinstance(valCol,(list,tuple))
+    valCols = [colIndex(df,c) for c in valCol] if multi else [colIndex(df,valCol)]
+    valCol = valCols[0]
+    metrics = [df.columns[c] for c in valCols]
+    #With time buckets the keys are (key,bucket) or (key,bucket,metric)
+    width = bucketWidths.get(bucket,bucket)
+    composite = multi or timeCol is not None
+    schema = boxSchema(df,keyCol,olKeep,metric=multi,bucket=timeCol is not None)
+
+    if mode in ('pandas','sql'):
+        from pyspark.sql import functions as F
+        # Only the needed columns are selected, with the key renamed to
+        # 'key' and the values to 'val'
+        keyNames = ['key']
+        sdf = df
+        if timeCol is not None:
+            # The bucket label is computed in the JVM, same as timeBucket
+            sdf = sdf.withColumn('bucket', F.from_unixtime(
+                      F.floor(F.col(df.columns[timeCol]).cast('double') / width)
+                      * width, 'yyyy-MM-dd HH:mm'))
+            keyNames.append('bucket')
+        sdf = sdf.withColumnRenamed(df.columns[keyCol],'key')
+        if multi:
+            # Long format with one (key, [bucket,] metric, value) row per measure
+            sdf = sdf.select(*(keyNames + [F.explode(F.array(*[
+                      F.struct(F.lit(m).alias('metric'),
+                               F.col(m).cast('double').alias('val'))
+                      for m in metrics])).alias('m')])).select(
+                      *(keyNames + ['m.metric', 'm.val']))
+            keyNames.append('metric')
+        else:
+            sdf = sdf.select(*(keyNames + [F.col(metrics[0]).cast('double').alias('val')]))
+        sdf = sdf.dropna()
+
+        if mode == 'sql':
+            res = boxSql(sdf,keyNames,rankErr,olKeep,olSample)
+        else:
+            heavy = None
+            if skew:
+                # The heavy keys are taken out of the grouped map and
+                # computed with boxExact
+                counts = sdf.sample(False,sampleFrac,25).groupBy(*keyNames).count()
+                total = counts.groupBy().sum('count').first()[0] or 0
+                nParts = numPartitions or sdf.rdd.getNumPartitions()
+                heavy = F.broadcast(counts.where(
+                          F.col('count') > total / float(nParts)).select(*keyNames))
+                heavyVals = sdf.join(heavy,keyNames,'left_semi')
+                sdf = sdf.join(heavy,keyNames,'left_anti')
+            # Only the key and value columns are sent to the python workers
+            grouped = sdf.groupBy(*keyNames)
+            fun = lambda pdf: boxFrame(pdf,olKeep,olSample)
+            if hasattr(grouped,'applyInPandas'):
+                res = grouped.applyInPandas(fun,schema)
+            else:
+                from pyspark.sql.functions import pandas_udf, PandasUDFType
+                res = grouped.apply(pandas_udf(fun,schema,PandasUDFType.GROUPED_MAP))
+            if heavy is not None:
+                nKey = len(keyNames)
+                rows = boxExact(heavyVals.rdd.map(
+                          lambda x: (tuple(x[:nKey]) if nKey > 1 else x[0], x[nKey])),
+                          olKeep,olSample,numPartitions)
+                if nKey > 1:
+                    rows = rows.map(lambda row: list(row[0]) + row[1:])
+                res = res.union(rows.toDF(schema))
+        return boxWide(res,metrics) if multi and wide else res
 
     #I converter the data frame to an rdd
     rdd = df.rdd
     # The datafram is maped to a list of tupples as
-    # (key,val)
-    rddKeyValue = rdd.map(lambda x: (x[keyCol],x[valCol]))
-    rddKeyValue.cache()
-    # Collect the list of unique keys
-    keys = rdd.map(lambda x: x[keyCol]).distinct().collect()
-    # Iterate throught all keys    
-    params =dict()  #Create a dictonary sotring all values
-    for key in keys:
-        #Collect the values to a vector         
-        valVect = rddKeyValue.filter(
-                  lambda pair: pair[0]==key
-                  ).map(
-                  lambda pair: pair[1]
-                  ).collect()
-        #Compute the box parameters                      
-        params[key] = boxParams(valVect)
-    return rdd.context.parallelize(
-            [[k] + v for k, v in params.items()]
-            ).toDF(['key','Q1','Q2','Q3','IQR','Qmax','Qmin','OL'])
-                      
+    # (key,val) or ((key,[bucket,][metric]),val) for composed keys
+    if timeCol is None:
+        keyParts = lambda x: (x[keyCol],)
+    else:
+        rdd = rdd.filter(lambda x: x[timeCol] is not None)
+        keyParts = lambda x: (x[keyCol],timeBucket(x[timeCol],width))
+    if multi:
+        rddKeyValue = rdd.flatMap(
+                  lambda x: [(keyParts(x) + (m,),x[c])
+                             for m, c in zip(metrics,valCols) if x[c] is not None])
+    elif composite:
+        rddKeyValue = rdd.filter(lambda x: x[valCol] is not None).map(
+                  lambda x: (keyParts(x),x[valCol]))
+    else:
+        rddKeyValue = rdd.filter(lambda x: x[valCol] is not None).map(
+                  lambda x: (x[keyCol],x[valCol]))
+    heavyRows = None
+    if skew and mode in ('group','kernel'):
+        heavy = heavyKeys(rddKeyValue,sampleFrac,numPartitions)
+        if heavy:
+            # The heavy keys are computed with boxExact, spread over several
+            # tasks, and the rest with the selected mode
+            heavy = rdd.context.broadcast(heavy)
+            heavyRows = boxExact(rddKeyValue.filter(lambda kv: kv[0] in heavy.value),
+                                 olKeep,olSample,numPartitions)
+            rddKeyValue = rddKeyValue.filter(lambda kv: kv[0] not in heavy.value)
+    if mode == 'group':
+        # All the values of a key end in the same task after the shuffle,
+        # the box parameters are computed there.
+        rows = rddKeyValue.groupByKey().map(
+                  lambda kv: [kv[0]] + boxParams(list(kv[1])))
+    elif mode == 'kernel':
+        if numPartitions is None:
+            numPartitions = rdd.getNumPartitions()
+        rows = rddKeyValue.partitionBy(numPartitions).mapPartitions(boxPartition)
+    elif mode == 'sketch':
+        # The digests are built on the map side for each partition and
+        # merged after the shuffle (combineByKey)
+        comp = compressionForError(rankErr)
+        nExt = max(comp, olKeep or 0)
+        digests = rddKeyValue.combineByKey(
+                  lambda v: TDigest(comp,nExt).add(v),
+                  lambda d, v: d.add(v),
+                  lambda d1, d2: d1.merge(d2))
+        def sketchRow(kv):
+            row = [kv[0]] + boxParamsSketch(kv[1])
+            if olKeep is None:
+                return row
+            # The digest only keeps the extremes, the count is estimated
+            return compactRow(row,olKeep,olSample,
+                              sketchOutlierCount(kv[1],row[1],row[3]))
+        rows = digests.map(sketchRow)
+    elif mode == 'exact':
+        rows = boxExact(rddKeyValue,olKeep,olSample,numPartitions)
+    elif mode == 'filter':
+        rddKeyValue.cache()
+        # Collect the list of unique keys
+        keys = rddKeyValue.keys().distinct().collect()
+        # Iterate throught all keys
+        params =dict()  #Create a dictonary sotring all values
+        for key in keys:
+            #Collect the values to a vector
+            valVect = rddKeyValue.filter(
+                      lambda pair: pair[0]==key
+                      ).map(
+                      lambda pair: pair[1]
+                      ).collect()
+            #Compute the box parameters
+            params[key] = boxParams(valVect)
+        rows = rdd.context.parallelize([[k] + v for k, v in params.items()])
+    else:
+        raise ValueError("mode: unknown mode '%s'" % mode)
+
+    if olKeep is not None and mode not in ('sketch','exact'):
+        rows = rows.map(lambda row: compactRow(row,olKeep,olSample))
+    if heavyRows is not None:
+        rows = rows.union(heavyRows)
+    if composite:
+        # The composed key is split in its columns
+        rows = rows.map(lambda row: list(row[0]) + row[1:])
+    res = rows.toDF(schema)
+    return boxWide(res,metrics) if multi and wide else res
+
+
+def saveBoxParams(boxPrms,path):
+    """
+    Stores the data frame generated by boxPerKey in Parquet format in path.
+    The outliners are kept as a list column, the plotting scripts load it
+    with reportData.readBoxParams.
+    The rows are sorted by key, so the min/max statistics of each row group
+    cover a narrow range of keys and reading a few keys skips the rest.
+    """
+    boxPrms.orderBy('key').write.mode('overwrite').parquet(path)
+
 
 # Test module only runs if this scritp is runed as main program
 if __name__ == "__main__":
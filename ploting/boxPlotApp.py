@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Dashboard of the memory performance box plots, run by the bokeh server.
+
+Instead of writing all the services to static html files, only the page of
+services selected by the user is loaded and plotted. At start up just the
+services memory table is read, to split the services by VM type and in pages.
+The box parameters (with the outliners) of a page are read from the Parquet
+files when the page is selected, through reportData.loadReportPage, which
+keeps the last pages used in a LRU cache shared by all the sessions.
+
+Run this dashboard by executing this line:
+    bokeh serve --show boxPlotApp.py --args tmem.csv boxPlots.parquet
+
+@author: julia.delos
+"""
+import sys
+
+from bokeh.io import curdoc
+from bokeh.layouts import column, row
+from bokeh.models import Select
+
+from ploting_lib import plotBarBoxPlot
+from performanceReport import groupsByType, paginate
+from reportData import loadReportPage, readServiceIndex
+
+tmemPath = sys.argv[1] if len(sys.argv) > 1 else 'tmem.csv'
+boxPath = sys.argv[2] if len(sys.argv) > 2 else 'boxPlots.parquet'
+
+#Maximum number of services per plot and size of the plot
+perPage = 12
+pltSize = [800,400]
+
+#Pages of each VM type, as tuples of service names
+titles = []
+pages = {}
+for title, table, _ in groupsByType(readServiceIndex(tmemPath)):
+    titles.append(title)
+    pages[title] = [tuple(p['SrvName']) for p in paginate(table, perPage)]
+
+
+def pageLabels(title):
+    # Labels of the page selector: first and last service of each page
+    return ['%d: %s ... %s' % (i + 1, p[0], p[-1]) for i, p in enumerate(pages[title])]
+
+
+def pagePlot(title, page):
+    # Plot of the page (index) of the VM type title
+    tdata = loadReportPage(tmemPath, boxPath, pages[title][page])
+    p = plotBarBoxPlot(tdata, pltSize, title)
+    p.xaxis.axis_label = "Service name"
+    p.yaxis.axis_label = "memory [GiB]"
+    return p
+
+
+groupSel = Select(title="VM type", value=titles[0], options=titles)
+pageSel = Select(title="Services", value=pageLabels(titles[0])[0],
+                 options=pageLabels(titles[0]))
+layout = column(row(groupSel, pageSel), pagePlot(titles[0], 0))
+
+
+def updateGroup(attr, old, new):
+    # The new group shows its first page, which triggers updatePage
+    pageSel.options = pageLabels(new)
+    pageSel.value = pageSel.options[0]
+
+
+def updatePage(attr, old, new):
+    page = pageSel.options.index(new)
+    layout.children[1] = pagePlot(groupSel.value, page)
+
+
+groupSel.on_change('value', updateGroup)
+pageSel.on_change('value', updatePage)
+
+curdoc().add_root(layout)
+curdoc().title = "Memory performance"
@@ -17,77 +17,30 @@ Created on Wed Nov 02 20:26:49 2016
 @author: julia.delos
 """
 #Import modules 
-import pandas as pd
-import numpy as np
-from ploting_lib import plotBarBoxPlot
-from bokeh.plotting import output_file, show
-from bokeh.layouts import column
-
-
-#load the services memory information it contains the average 
-# and the inferred VM memory size
-tmem = pd.read_csv('tmem.csv')
-#Adding a column that sorts the 
-tmem['type']=np.round(np.log2(tmem['tpmGb']/1.75)).astype(int) 
-
-
-#Load the services box plot description
-boxPrms = pd.read_csv('./boxPlots.csv')
-#First data has to be transfomred from Mb to Gb
-boxPrms.loc[:,'Q1':'Qmin'] = boxPrms.loc[:,'Q1':'Qmin']/1024
-
-#The outliers column has been converted to a big string it has to be reparsed 
-# into a list of values 
-lst_prsd = [None] * len(boxPrms['OL'])
-i=0
-for val in boxPrms['OL']:
-    if len(val) > 2:
-            lst_prsd[i] = (np.array(map(float,val[1:-1].split(',')))/1024).tolist()
-    i=i+1
-#The parsed result is stored in the OL column   
-boxPrms['OL'] = lst_prsd
-
-#Merge both tables in a single one
-tdata = pd.merge(tmem,boxPrms,how='left',left_on='SrvName',right_on='key')
-
-#Shape the data within the necessary format structure for the plotting function
-#  CAT | AVG | MAX_VAL | Q1 | Q2 | Q3| ICQ |Qmax | Qmin | [OL]
-# That will be mapped as 
-# SrvNameInst -->
-# avgGb       --> 
-tdata_frmt = tdata[['SrvNameInst','tpmGb','avgGb','Q1','Q2','Q3','IQR','Qmax','Qmin','OL']]
-
-
-#Define two sizes for the plots
-lyt1=[[400,500], [800,400]]        
-
-#Plot the big VM
-output_file("boxplot_1.html", title="boxplot.py example")
-p1 = plotBarBoxPlot(tdata_frmt[tmem['type']>3],lyt1[0],'Biggest VM',
-                    bar_color=['#66CDAA','#20B2AA'],box_fill=['#B0C4DE'],
-                    box_width=0.5)
-p1.xaxis.axis_label = "Service name"
-p1.yaxis.axis_label = "memory [GiB]"
-show(p1)
-
-
-#Plot the 14GB virtual machines
-output_file("boxplot_2.html", title="boxplot.py example")
-p2 = plotBarBoxPlot(tdata_frmt[tmem['type']==3].head(n=8),lyt1[1],'14 Gb VM')
-p3 = plotBarBoxPlot(tdata_frmt[tmem['type']==3].tail(n=8),lyt1[2],'14 Gb VM')
-show(column(p2,p3))
-
-#Plot the 7 Gb virtual machines
-output_file("boxplot_3.html", title="boxplot.py example")
-p4 = plotBarBoxPlot(tdata_frmt[tmem['type']==2].head(n=11),lyt1[1],'7 Gb VM')
-p5 = plotBarBoxPlot(tdata_frmt[tmem['type']==2].tail(n=10),lyt1[2],'7 Gb VM')
-show(column(p4,p5))
-
-#Plot the 3.5Gb VM and smaller
-output_file("boxplot_4.html", title="boxplot.py example")
-p6 = plotBarBoxPlot(tdata_frmt[tmem['type']==1],lyt1[1],'3.5 Gb VM')
-p7 = plotBarBoxPlot(tdata_frmt[tmem['type']==0],lyt1[2],'3.5 Gb VM')
-show(column(p6,p7))
-
-
-
+from bokeh.util.browser import view
+from performanceReport import buildReport, groupsByType
+from reportData import loadReportTable
+
+
+if __name__ == "__main__":
+    #Load the table with the services memory information (average and inferred
+    # VM memory size) merged with their box plot description, in GB.
+    #The table is built by reportData.loadReportTable and cached on disk, with the
+    # format structure needed by the plotting function
+    #  CAT | AVG | MAX_VAL | Q1 | Q2 | Q3| ICQ |Qmax | Qmin | [OL] | type
+    # where type sorts the services by the VM size
+    tdata_frmt = loadReportTable('tmem.csv','./boxPlots.parquet')
+
+    #One section per VM type: biggest VM, 14 Gb, 7 Gb, 3.5 Gb... Each one has
+    # as many plots as needed to show at most 12 services per plot.
+    groups = groupsByType(tdata_frmt)
+    #The biggest VM are few, plotted in a narrow plot with their own colors
+    if groups and groups[0][0] == 'Biggest VM':
+        groups[0][2].update(plt_size=[400,500], bar_color=['#66CDAA','#20B2AA'])
+
+    #The groups are rendered in parallel, one process per core, and written to
+    # a single html file loading the bokeh resources once. Set bundle=None to
+    # write a file per group.
+    for fname in buildReport(groups, per_page=12, plt_size=[800,400],
+                             bundle='memoryReport.html'):
+        view(fname)
@@ -17,51 +17,25 @@ Created on Wed Nov 02 20:26:49 2016
 @author: julia.delos
 """
 #Import modules 
-import pandas as pd
-import numpy as np
 from ploting_lib import plotBarBoxPlot
+from reportData import loadReportTable
 from bokeh.plotting import output_file, show
 from bokeh.layouts import column
 
 
-#load the services memory information it contains the average 
-# and the inferred VM memory size
-tmem = pd.read_csv('tmem.csv')
-#Adding a column that sorts the 
-tmem['type']=np.round(np.log2(tmem['tpmGb']/1.75)).astype(int) 
-
-
-#Load the services box plot description
-boxPrms = pd.read_csv('./boxPlots.csv')
-#First data has to be transfomred from Mb to Gb
-boxPrms.loc[:,'Q1':'Qmin'] = boxPrms.loc[:,'Q1':'Qmin']/1024
-
-#The outliers column has been converted to a big string it has to be reparsed 
-# into a list of values 
-lst_prsd = [None] * len(boxPrms['OL'])
-i=0
-for val in boxPrms['OL']:
-    if len(val) > 2:
-            lst_prsd[i] = (np.array(map(float,val[1:-1].split(',')))/1024).tolist()
-    i=i+1
-#The parsed result is stored in the OL column   
-boxPrms['OL'] = lst_prsd
-
-#Merge both tables in a single one
-tdata = pd.merge(tmem,boxPrms,how='left',left_on='SrvName',right_on='key')
-
-#Shape the data within the necessary format structure for the plotting function
-#  CAT | AVG | MAX_VAL | Q1 | Q2 | Q3| ICQ |Qmax | Qmin | [OL]
-# That will be mapped as 
-# SrvNameInst -->
-# avgGb       --> 
-tdata_frmt = tdata[['SrvNameInst','tpmGb','avgGb','Q1','Q2','Q3','IQR','Qmax','Qmin','OL']]
+#Load the table with the services memory information (average and inferred
+# VM memory size) merged with their box plot description, in GB.
+#The table is built by reportData.loadReportTable and cached on disk, with the
+# format structure needed by the plotting function
+#  CAT | AVG | MAX_VAL | Q1 | Q2 | Q3| ICQ |Qmax | Qmin | [OL] | type
+# where type sorts the services by the VM size
+tdata_frmt = loadReportTable('tmem.csv','./boxPlots.parquet')
 
 
 #Define two sizes for the plots
 lyt1=[[400,500], [800,400]]        
 
-table=tdata_frmt[tmem['type']>3]
+table=tdata_frmt[tdata_frmt['type']>3]
 table.iloc[:,0] = ['B2B','PROD','PAK','AGT']
 
 #Plot the big VM
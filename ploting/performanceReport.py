@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Report generator for the memory performance plots.
+
+The services of each group (e.g. VM type) are split in pages with at most
+a given number of categories per page. Each page is plotted with
+ploting_lib.plotBarBoxPlot and the pages of a group are written one below
+the other to their own html file.
+
+The pages are rendered in a process pool, one task per page, so a report with
+a few groups of hundreds of services still uses all the cores. Each process
+builds its figure from the data and returns it as a json item (bokeh objects
+are not shared between processes), the parent process writes the html files.
+The items are embedded as json documents whose numeric columns are numpy
+arrays, serialised by bokeh as base64 binary buffers instead of lists of
+numbers in text.
+
+With bundle all the groups are written to a single html file instead, which
+loads BokehJS once for the whole report.
+
+Created on Mon Nov 14 10:02:31 2016
+
+@author: julia.delos
+"""
+import json
+import os
+from math import ceil
+from multiprocessing import Pool
+
+from bokeh.embed import json_item
+from bokeh.resources import CDN
+
+from ploting_lib import plotBarBoxPlot
+
+#Names of the VM types of the column 'type' of the report table
+vmTypeTitles = {0: '1.75 Gb VM', 1: '3.5 Gb VM', 2: '7 Gb VM', 3: '14 Gb VM'}
+
+
+def paginate(table, per_page):
+    """
+     Splits the rows of the pandas data frame table in pages of at most
+     per_page rows. The rows are distributed evenly among the pages, e.g. 21
+     rows with per_page=12 give two pages of 11 and 10 rows.
+    """
+    n_pages = max(int(ceil(len(table) / float(per_page))), 1)
+    size = max(int(ceil(len(table) / float(n_pages))), 1)
+    return [table.iloc[i:i + size] for i in range(0, max(len(table), 1), size)]
+
+
+def groupsByType(tdata, big_type=3):
+    """
+     Splits the report table tdata in groups by the column 'type'. All the
+     types above big_type are grouped as 'Biggest VM'.
+     Returns a list of (title, table, {}) sorted from the biggest VM type.
+    """
+    groups = [('Biggest VM', tdata[tdata['type'] > big_type], {})]
+    for t in sorted(set(tdata['type']), reverse=True):
+        if t <= big_type:
+            groups.append((vmTypeTitles.get(t, 'VM type %d' % t),
+                           tdata[tdata['type'] == t], {}))
+    return [g for g in groups if len(g[1]) > 0]
+
+
+#Html page of a report, the sections are filled with the divs of each group
+bundleTemplate = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>%(title)s</title>
+%(resources)s
+</head>
+<body>
+%(sections)s
+<script type="text/javascript">
+var items = %(items)s;
+for (var id in items) { Bokeh.embed.embed_item(items[id], id); }
+</script>
+</body>
+</html>
+"""
+
+
+def renderPage(task):
+    """
+     Renders a page of a group and returns its json item. task is the tuple
+     (title, table, options) where table holds the rows of the page and
+     options the arguments of buildReport.
+     Runs in the worker processes of buildReport.
+    """
+    title, table, options = task
+    options = dict(options)
+    plt_size = options.pop('plt_size')
+    x_label = options.pop('x_label')
+    y_label = options.pop('y_label')
+    p = plotBarBoxPlot(table, plt_size, title, **options)
+    p.xaxis.axis_label = x_label
+    p.yaxis.axis_label = y_label
+    return json_item(p)
+
+
+def writeBundle(filename, titles, items, title="Memory performance report"):
+    """
+     Writes the json items of the pages of the groups, with their titles, to a
+     single html file loading the BokehJS resources once. items holds the
+     list of the json items of each group.
+    """
+    sections = []
+    data = {}
+    for g, (t, pages) in enumerate(zip(titles, items)):
+        ids = ['group_%d_%d' % (g + 1, i + 1) for i in range(len(pages))]
+        sections.append('<h2>%s</h2>\n' % t + '\n'.join('<div id="%s"></div>' % i for i in ids))
+        data.update(zip(ids, pages))
+    # '</' is escaped so a value of the data can not close the script tag
+    data = json.dumps(data, separators=(',', ':')).replace('</', '<\\/')
+    with open(filename, 'w') as fd:
+        fd.write(bundleTemplate % {'title': title, 'resources': CDN.render(),
+                                   'sections': '\n'.join(sections), 'items': data})
+    return filename
+
+
+def buildReport(groups, per_page=10, plt_size=[800,400], prefix='boxplot',
+                out_dir='.', processes=None, x_label="Service name",
+                y_label="memory [GiB]", bundle=None, **plot_args):
+    """
+     Writes a html file per group with its pages of box plots.
+     Input arguments:
+        groups    --> List of (title, table, options), table with the schema of
+                      plotBarBoxPlot and options a dictionary overriding the
+                      arguments below for the group, e.g. {'plt_size':[400,500]}
+        per_page  --> Maximum number of categories per plot. Default 10
+        plt_size  --> [width, high] of each page plot. Default 800px X 400px
+        prefix    --> Files are named <prefix>_<n>.html. Default 'boxplot'
+        out_dir   --> Directory of the html files. Default current directory
+        processes --> Size of the process pool. Default number of cores
+        x_label, y_label --> Axis labels of the plots
+        bundle    --> File name of a single html file with all the groups. Default
+                      None, one file per group
+        plot_args --> Extra arguments of plotBarBoxPlot (bar_color, plot_ol...)
+     Returns the list of generated files.
+    """
+    defaults = dict(plot_args, per_page=per_page, plt_size=plt_size,
+                    x_label=x_label, y_label=y_label)
+    tasks = []
+    n_pages = []
+    for title, table, options in groups:
+        options = dict(defaults, **options)
+        pages = paginate(table, options.pop('per_page'))
+        tasks.extend((title, page, options) for page in pages)
+        n_pages.append(len(pages))
+    pool = Pool(processes)
+    try:
+        res = pool.map(renderPage, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    # The json items of the pages of each group
+    items = []
+    for n in n_pages:
+        items.append(res[:n])
+        res = res[n:]
+    titles = [g[0] for g in groups]
+    if bundle:
+        return [writeBundle(os.path.join(out_dir, bundle), titles, items)]
+    return [writeBundle(os.path.join(out_dir, '%s_%d.html' % (prefix, i + 1)), [t], [g], t)
+            for i, (t, g) in enumerate(zip(titles, items))]
@@ -4,6 +4,13 @@
 ploting_lib is a collection of functions that allows to overlay box plots 
 and bar plots.
 
+It also provides plotMultiLine, to plot many long series (e.g. chromatograms)
+downsampled with the Largest-Triangle-Three-Buckets algorithm to the width
+of the plot in pixels, which keeps their shape while the browser only draws
+a few hundred points per series. plotLinkedSpectra builds linked RT/MZ plots
+from ragged arrays (flat values plus offsets), sent to the browser as binary
+arrays.
+
 
 
 Created on Mon Nov 07 16:06:16 2016
@@ -13,12 +20,308 @@ Created on Mon Nov 07 16:06:16 2016
 """
 
 from bokeh.plotting import figure
+from bokeh.models import ColumnDataSource, HoverTool, TapTool
+from bokeh.layouts import gridplot
+import numpy as np
 from numpy import pi
 from math import ceil
 
+
+def dataSource(data, source=None):
+    """
+     Returns a ColumnDataSource with the columns in the dictionary data.
+     If source is given the columns are added to it (replacing the ones with
+     the same name), so all the glyphs of a figure can share a single source.
+    """
+    if source is None:
+        return ColumnDataSource(data=data)
+    for name, col in data.items():
+        source.data[name] = col
+    return source
+
+
+def checkColumn(name, values, n_cats):
+    # Converts values to a float numpy array and checks its length
+    if not hasattr(values, '__len__'):
+        raise ValueError("%s is not a list" % name)
+    values = np.asarray(values, dtype=float)
+    if len(values) != n_cats:
+        raise ValueError("%s has the wrong length" % name)
+    return values
+
+def flattenOutliers(x_cats, OL):
+    """
+     Flattens the outliners of each category in two numpy arrays (category,
+     value) using numpy concatenation, in linear time. OL has a list or array
+     of outliners per category, or None/NaN for the categories without them.
+    """
+    ols = [np.asarray(o, dtype=float) if hasattr(o, '__len__') else np.empty(0)
+           for o in OL]
+    if not ols:
+        return np.empty(0, dtype=object), np.empty(0)
+    lens = np.array([o.size for o in ols])
+    cats = np.empty(len(x_cats), dtype=object)
+    cats[:] = x_cats
+    return np.repeat(cats, lens), np.concatenate(ols)
+
+
+def densityOutliers(x_cats, OL, n_bins=20):
+    """
+     Aggregates the outliners of each category in n_bins bins of the value
+     axis, between the smallest and the largest outliner of the category, so a
+     category with a narrow range of outliners is not squeezed in a single bin
+     of the range of all categories. Returns the arrays (category, bin centre,
+     number of outliners) of the non empty bins.
+    """
+    # Flattened with the category indexes as categories
+    cat_idx, vals = flattenOutliers(list(range(len(x_cats))), OL)
+    cat_idx = cat_idx.astype(int)
+    if vals.size == 0:
+        return np.empty(0, dtype=object), vals, np.empty(0, dtype=int)
+    # Range of the outliners of each category
+    lo = np.full(len(x_cats), np.inf)
+    hi = np.full(len(x_cats), -np.inf)
+    np.minimum.at(lo, cat_idx, vals)
+    np.maximum.at(hi, cat_idx, vals)
+    step = (hi - lo) / n_bins
+    # A category with a single value puts all its outliners in the first bin
+    width = np.where(step > 0, step, 1.0)
+    bin_idx = np.clip(((vals - lo[cat_idx]) / width[cat_idx]).astype(int), 0, n_bins - 1)
+    counts = np.bincount(cat_idx * n_bins + bin_idx, minlength=len(x_cats) * n_bins)
+    cells = np.flatnonzero(counts)
+    cell_cat = cells // n_bins
+    centres = np.where(step[cell_cat] > 0,
+                       lo[cell_cat] + (cells % n_bins + 0.5) * step[cell_cat], lo[cell_cat])
+    all_cats = np.empty(len(x_cats), dtype=object)
+    all_cats[:] = x_cats
+    return all_cats[cell_cat], centres, counts[cells]
+
+
+def checkOffsets(offsets, size):
+    # Converts offsets to an int numpy array and checks they are valid offsets
+    # of an array of the given size
+    offsets = np.asarray(offsets, dtype=int)
+    if (offsets.ndim != 1 or offsets.size == 0 or offsets[0] < 0 or
+            offsets[-1] > size or np.any(np.diff(offsets) < 0)):
+        raise ValueError("offsets are not valid offsets of values")
+    return offsets
+
+
+def raggedSeries(values, offsets):
+    """
+     Splits the flat array values in the series values[offsets[i]:offsets[i+1]]
+     (the layout of the Arrow list arrays). Returns a list of numpy views of
+     values, without copying them, which bokeh sends as binary arrays.
+    """
+    values = np.asarray(values, dtype=float)
+    offsets = checkOffsets(offsets, values.size)
+    return np.split(values[offsets[0]:offsets[-1]], offsets[1:-1] - offsets[0])
+
+
+def ranges(lo, lens):
+    # Flat indexes of the ranges [lo[i], lo[i]+lens[i]) concatenated
+    seg_starts = np.cumsum(lens) - lens
+    return np.repeat(lo - seg_starts, lens) + np.arange(lens.sum())
+
+
+def lttbRagged(x, y, offsets, n_out):
+    """
+     Downsamples series with the Largest-Triangle-Three-Buckets algorithm.
+     The points of a series are split in n_out-2 buckets and from each bucket
+     the point forming the largest triangle with the point kept from the
+     previous bucket and the average of the next bucket is kept. The first and
+     last points are always kept.
+     Input arguments:
+        x, y    --> Flat arrays with the values of all the series
+        offsets --> Offsets of the series, the series i is [offsets[i], offsets[i+1])
+        n_out   --> Number of points kept per series
+     Returns the flat arrays (x, y) and the offsets of the downsampled series.
+     The series with n_out points or less are kept whole. The computation is
+     vectorised over all the series, only the buckets are looped.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if x.size != y.size:
+        raise ValueError("x and y have different size. Both have to be the same.")
+    offsets = checkOffsets(offsets, y.size)
+    starts = offsets[:-1]
+    n = np.diff(offsets)
+    down = n > n_out if n_out >= 3 else np.zeros(n.size, dtype=bool)
+    out_len = np.where(down, n_out, n)
+    out_off = np.r_[0, np.cumsum(out_len)]
+    out_idx = np.empty(out_off[-1], dtype=int)
+    out_idx[ranges(out_off[:-1][~down], n[~down])] = ranges(starts[~down], n[~down])
+
+    st = starts[down]
+    ns = n[down]
+    if ns.size:
+        #Bucket k of each series holds the points [edges[k], edges[k+1]), the
+        # last bucket is the last point alone
+        every = (ns - 2) / float(n_out - 2)
+        edges = (np.floor(np.arange(n_out - 1)[None, :] * every[:, None]) + 1).astype(int)
+        edges[:, -1] = ns - 1
+        edges = st[:, None] + np.c_[edges, ns]
+        idx = np.empty((ns.size, n_out), dtype=int)
+        idx[:, 0] = st
+        idx[:, -1] = st + ns - 1
+        for k in range(n_out - 2):
+            #Average of the next bucket of each series
+            nlens = edges[:, k + 2] - edges[:, k + 1]
+            nxt = ranges(edges[:, k + 1], nlens)
+            nstarts = np.cumsum(nlens) - nlens
+            cx = np.add.reduceat(x[nxt], nstarts) / nlens
+            cy = np.add.reduceat(y[nxt], nstarts) / nlens
+            #Area of the triangles of the points of the bucket
+            lens = edges[:, k + 1] - edges[:, k]
+            cand = ranges(edges[:, k], lens)
+            seg = np.repeat(np.arange(ns.size), lens)
+            ax = x[idx[:, k]]
+            ay = y[idx[:, k]]
+            area = np.abs((ax - cx)[seg] * (y[cand] - ay[seg]) -
+                          (ax[seg] - x[cand]) * (cy - ay)[seg])
+            area[np.isnan(area)] = -1
+            #First point with the largest area of each bucket
+            seg_starts = np.cumsum(lens) - lens
+            best = np.flatnonzero(area == np.maximum.reduceat(area, seg_starts)[seg])
+            idx[:, k + 1] = cand[best[np.searchsorted(best, seg_starts)]]
+        out_idx[(out_off[:-1][down][:, None] + np.arange(n_out)).ravel()] = idx.ravel()
+    return x[out_idx], y[out_idx], out_off
+
+
+def lttb(x, y, n_out):
+    """
+     Downsamples with lttbRagged series with the same number of points.
+     Input arguments:
+        x     --> 2D array (n_series, n_points) or 1D array shared by all series
+        y     --> 2D array (n_series, n_points)
+        n_out --> Number of points kept per series
+     Returns the 2D arrays (x, y) with n_out points per series, or the input
+     when the series have n_out points or less.
+    """
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    x = np.broadcast_to(np.asarray(x, dtype=float), y.shape)
+    n_series, n = y.shape
+    if n_out >= n or n_out < 3:
+        return x, y
+    dx, dy, _ = lttbRagged(x.ravel(), y.ravel(), np.arange(n_series + 1) * n, n_out)
+    return dx.reshape(n_series, n_out), dy.reshape(n_series, n_out)
+
+
+def lttbSeries(xs, ys, n_out):
+    """
+     Downsamples with lttbRagged the series (xs[i], ys[i]), which can have
+     different lengths. Returns the lists of arrays (xs, ys).
+    """
+    if len(xs) != len(ys):
+        raise ValueError("xs and ys have different size. Both have to be the same.")
+    xs = [np.asarray(v, dtype=float).ravel() for v in xs]
+    ys = [np.asarray(v, dtype=float).ravel() for v in ys]
+    lens = np.array([v.size for v in ys], dtype=int)
+    if any(vx.size != vy.size for vx, vy in zip(xs, ys)):
+        raise ValueError("The x and y of a series have different size.")
+    if lens.size == 0:
+        return xs, ys
+    dx, dy, offsets = lttbRagged(np.concatenate(xs), np.concatenate(ys),
+                                 np.r_[0, np.cumsum(lens)], n_out)
+    return raggedSeries(dx, offsets), raggedSeries(dy, offsets)
+
+
+def plotMultiLine(xs, ys, n_out=None, webgl=False, xs_name='xs', ys_name='ys',
+                  plt=None, plt_size=[450,300], title=None, source=None,
+                  **line_opts):
+    """
+     Function returns a figure object with a multi line glyph of the series
+     (xs[i], ys[i]), each one downsampled with LTTB.
+     Input arguments:
+        xs, ys  --> Lists with the x and y values of each series
+        n_out   --> Number of points kept per series. Default the width of
+                    the plot in pixels. 0 keeps all the points.
+        webgl   --> Render the plot with WebGL. Default False
+        xs_name, ys_name --> Columns of the source with the downsampled series.
+                    Default 'xs' and 'ys'
+        plt     --> Figure handler, if not given a new handler will be created.
+                    If given the arguments plt_size, title are ignored.
+        plt_size --> [width, high] of the plot Default: 450px X 300px
+        title   --> String defining the title of the plot.
+        source  --> ColumnDataSource with extra columns of the series (color,
+                    tooltips...), e.g. shared with a linked plot. If not given
+                    a new one is created.
+        line_opts --> Extra arguments of multi_line (line_color, legend...)
+    """
+    if plt is None:
+        plt = figure(plot_width=plt_size[0],
+                     plot_height=plt_size[1],
+                     title=title)
+    if webgl:
+        plt.output_backend = 'webgl'
+    if n_out is None:
+        n_out = plt.plot_width
+    if n_out:
+        xs, ys = lttbSeries(xs, ys, n_out)
+
+    source = dataSource({xs_name: list(xs), ys_name: list(ys)}, source)
+    plt.multi_line(xs=xs_name, ys=ys_name, source=source, **line_opts)
+    return plt
+
+
+def plotLinkedSpectra(rt, rt_int, rt_offsets, mz, mz_int, mz_offsets,
+                      data=None, tooltips=None, plt_size=[450,300], n_out=None,
+                      webgl=False, **line_opts):
+    """
+     Function returns a grid with two linked multi line plots of a set of
+     series: the chromatograms (retention time, intensity) and the spectral
+     lines (MZ, intensity). The series are given as ragged arrays, flat numpy
+     arrays with the values of all the series plus an array of offsets.
+     Input arguments:
+        rt, rt_int  --> Flat arrays with the retention times and intensities
+                        of all the chromatograms
+        rt_offsets  --> Offsets of the chromatograms in rt and rt_int, the
+                        series i is [rt_offsets[i], rt_offsets[i+1])
+        mz, mz_int, mz_offsets --> Same for the spectral lines
+        data        --> Dictionary with columns of one value per series (color,
+                        values shown by the tooltips...)
+        tooltips    --> Tooltips of the hover tool, e.g. [('MZ', '@MZ_tip')].
+                        Default None, no hover tool.
+        plt_size    --> [width, high] of each plot. Default 450px X 300px
+        n_out, webgl --> Downsampling and WebGL output, see plotMultiLine
+        line_opts   --> Extra arguments of multi_line (line_color, legend...)
+     Both plots share a single ColumnDataSource (columns 'RT', 'RT_intensity',
+     'MZ' and 'MZ_intensity' plus data), so selecting a series in one plot
+     selects it in the other.
+    """
+    n_series = len(rt_offsets) - 1
+    if len(mz_offsets) - 1 != n_series:
+        raise ValueError("rt_offsets and mz_offsets have a different number of series.")
+    data = dict(data or {})
+    for name, col in data.items():
+        if len(col) != n_series:
+            raise ValueError("%s has the wrong length" % name)
+    source = ColumnDataSource(data=data)
+
+    plots = []
+    for xs, ys, offsets, xs_name, ys_name, x_label in [
+            (rt, rt_int, rt_offsets, 'RT', 'RT_intensity', "Retention Time (sec)"),
+            (mz, mz_int, mz_offsets, 'MZ', 'MZ_intensity', "MZ")]:
+        tools = [TapTool()]
+        if tooltips:
+            tools.insert(0, HoverTool(tooltips=tooltips, show_arrow=False,
+                                      line_policy='next'))
+        plt = figure(tools=tools, plot_width=plt_size[0], plot_height=plt_size[1])
+        #Downsampled on the flat arrays, without splitting them in series
+        if n_out is None or n_out:
+            xs, ys, offsets = lttbRagged(xs, ys, offsets, n_out or plt_size[0])
+        plotMultiLine(raggedSeries(xs, offsets), raggedSeries(ys, offsets),
+                      n_out=0, webgl=webgl, xs_name=xs_name, ys_name=ys_name,
+                      plt=plt, source=source, **line_opts)
+        plt.xaxis.axis_label = x_label
+        plt.yaxis.axis_label = "Intensity"
+        plots.append(plt)
+    return gridplot([plots])
+
+
 def plotHBarOver(xs,ys_bot,ys_top,width=0.5,color=None,line_width=1,alpha=None,
                  plt=None,plt_size=[400,400],title=None,legend=['Total','Mean'],
-                 ):
+                 source=None):
     """
      Function returns a figure object of an overlay of horizontal bar plot.
      Input arguments:
@@ -40,10 +343,14 @@ def plotHBarOver(xs,ys_bot,ys_top,width=0.5,color=None,line_width=1,alpha=None,
         plt         --> Figure handler, if not given a new handler will be created.
                         If given the arguments plt_size, title are ignored.
         title       --> String defining the title of the plot.
+        source      --> ColumnDataSource shared by the glyphs of the figure. If not
+                        given a new one is created. The layers are stored in the
+                        columns 'bar_bot<i>' and 'bar_top<i>'.
 
     """
     # Check arguments
-    if type(xs) == list:
+    if hasattr(xs, '__len__') and not isinstance(xs, str):
+        xs = list(xs)
         n_cats = len(xs)
     else:
         raise ValueError("xs is not a list")
@@ -83,7 +390,9 @@ def plotHBarOver(xs,ys_bot,ys_top,width=0.5,color=None,line_width=1,alpha=None,
         line_width = [line_width] * n_layers
 
     # Check the line_width parameters
-    if (alpha is not None) and len(alpha) != n_layers:
+    if alpha is None:
+        alpha = [1] * n_layers
+    elif len(alpha) != n_layers:
         raise ValueError("alpha: the argument list has the wrong length.")
 
     if plt is None:
@@ -101,10 +410,18 @@ def plotHBarOver(xs,ys_bot,ys_top,width=0.5,color=None,line_width=1,alpha=None,
                        title=title)
 
 
+    #All the layers are stored as numpy columns of a single source
+    data = {'x': xs}
+    for idx in range(0,n_layers):
+        data['bar_bot%d' % idx] = checkColumn('ys_bot', ys_bot[idx], n_cats)
+        data['bar_top%d' % idx] = checkColumn('ys_top', ys_top[idx], n_cats)
+    source = dataSource(data, source)
+
     #Generate the plots
     for idx in range(0,n_layers):
         # Plot first bar plot
-        plt.vbar(x=xs, width=width[idx],bottom=ys_bot[idx], top=ys_top[idx],
+        plt.vbar(x='x', width=width[idx], bottom='bar_bot%d' % idx,
+                top='bar_top%d' % idx, source=source,
                 color=color[idx],line_width=line_width[idx],alpha=alpha[idx],
                 line_alpha=0,legend=legend[idx])
 
@@ -113,6 +430,8 @@ def plotHBarOver(xs,ys_bot,ys_top,width=0.5,color=None,line_width=1,alpha=None,
 
 def plotBoxPlot(x_cats,q1,q2,q3,qmin,qmax,OL,
                  plot_ol=False,
+                 ol_mode='points',
+                 ol_bins=20,
                  box_alpha_fill=1,
                  box_line_width=1.5, 
                  box_line_color='#555555',
@@ -125,7 +444,8 @@ def plotBoxPlot(x_cats,q1,q2,q3,qmin,qmax,OL,
                  ol_mk_alpha=0.3,
                  ol_mk_color='black',
                  ol_mk_size=10,
-                 plt=None,plt_size=[400,400],title=None):
+                 ol_mk_min=3,
+                 plt=None,plt_size=[400,400],title=None,source=None):
     """
      Function returns a figure object of an overlay of horizontal bar plot.
      Input arguments:
@@ -155,51 +475,42 @@ def plotBoxPlot(x_cats,q1,q2,q3,qmin,qmax,OL,
         wsk_limits_width --> Width of the limit markers for the whiskers. Default 0.25.
 
         Outliner points design arguments:
-        ol_point_color --> Color for the outliner points. Default 'red'
+        plot_ol     --> Plot the outliners. Default False
+        ol_mode     --> 'points' plots a marker for each outliner. 'density'
+                        aggregates the outliners of each category in ol_bins
+                        bins and plots a marker per non empty bin, its size
+                        growing with the number of outliners (shown on hover).
+                        Use it when there are millions of outliners.
+        ol_bins     --> Number of bins of the 'density' mode. Default 20
+        ol_mk_alpha, ol_mk_color, ol_mk_size --> Alpha, color and size of the
+                        outliner markers (maximum size in 'density' mode).
+        ol_mk_min   --> Size of the marker of a bin with a single outliner in
+                        'density' mode, so the rare bins stay visible. Default 3
 
         plt         --> Figure handler, if not given a new handler will be created.
                         If given the arguments plt_size, title are ignored.
         title       --> String defining the title of the plot.
         plt_size    --> [width, high] of the plot Default: 400px X 400px
+        source      --> ColumnDataSource shared by the glyphs of the figure. If not
+                        given a new one is created. The box is stored in the
+                        columns 'x', 'q1', 'q2', 'q3', 'qmin' and 'qmax'.
 
     """
 
     #Check arguments
-    if type(x_cats) == list:
+    if hasattr(x_cats, '__len__') and not isinstance(x_cats, str):
+        x_cats = list(x_cats)
         n_cats = len(x_cats)
     else:
         raise ValueError("x_cats is not a list")
 
-    if type(q1) == list:
-        if len(q1) != n_cats:
-            raise ValueError("q1 has the wrong length")
-    else:
-        raise ValueError("q1 is not a list")
+    q1 = checkColumn('q1', q1, n_cats)
+    q2 = checkColumn('q2', q2, n_cats)
+    q3 = checkColumn('q3', q3, n_cats)
+    qmin = checkColumn('qmin', qmin, n_cats)
+    qmax = checkColumn('qmax', qmax, n_cats)
 
-    if type(q2) == list:
-        if len(q2) != n_cats:
-            raise ValueError("q2 has the wrong length")
-    else:
-        raise ValueError("q2 is not a list")
-
-    if type(q3) == list:
-        if len(q3) != n_cats:
-            raise ValueError("q3 has the wrong length")
-    else:
-        raise ValueError("q3 is not a list")
-    if type(qmin) == list:
-        if len(qmin) != n_cats:
-            raise ValueError("qmin has the wrong length")
-    else:
-        raise ValueError("qmin is not a list")
-
-    if type(qmax) == list:
-        if len(qmax) != n_cats:
-            raise ValueError("qmax has the wrong length")
-    else:
-        raise ValueError("qmax is not a list")
-
-    if type(OL) == list:
+    if hasattr(OL, '__len__'):
         if len(OL) != n_cats:
             raise ValueError("OL has the wrong length")
     else:
@@ -210,7 +521,7 @@ def plotBoxPlot(x_cats,q1,q2,q3,qmin,qmax,OL,
         if type(x_cats[0]) == str:
             plt = figure(plot_width=plt_size[0],
                        plot_height=plt_size[1],
-                       x_range=xs,
+                       x_range=x_cats,
                        title=title)
             # In such a case string will be tilted for better reading
             plt.xaxis.major_label_orientation = pi / 6
@@ -219,55 +530,61 @@ def plotBoxPlot(x_cats,q1,q2,q3,qmin,qmax,OL,
                        plot_height=plt_size[1],
                        title=title)
 
-    if plot_ol == True:
-        #Generate the lists to plot all the outliners
-        ol_pts = []
-        ol_cats = []
-        idx = 0
-        for ol_points in OL:
-            if ol_points:
-                ol_pts = ol_pts + ol_points
-                ol_cats = ol_cats + [x_cats[idx]] * len(ol_points)
-            idx += 1
-        plt.scatter(x=ol_cats, y=ol_pts,
+    if plot_ol == True and ol_mode == 'density':
+        #One marker per category and bin, sized by the number of outliners
+        ol_cats, ol_pts, ol_cnt = densityOutliers(x_cats, OL, ol_bins)
+        ol_size = ol_mk_min + (ol_mk_size - ol_mk_min) * np.sqrt(
+                  (ol_cnt - 1) / float(max(ol_cnt.max() - 1, 1)) if ol_cnt.size else ol_cnt)
+        ol_source = ColumnDataSource(data={'x': ol_cats.tolist(), 'y': ol_pts,
+                                           'count': ol_cnt, 'size': ol_size})
+        plt.scatter(x='x', y='y', size='size', source=ol_source,
+                    marker='o',
+                    alpha=ol_mk_alpha,
+                    fill_color=ol_mk_color,
+                    line_alpha=0)
+        plt.add_tools(HoverTool(renderers=plt.renderers[-1:],
+                                tooltips=[('outliners', '@count'), ('value', '@y')]))
+    elif plot_ol == True:
+        #All the outliners flattened in two arrays
+        ol_cats, ol_pts = flattenOutliers(x_cats, OL)
+        ol_source = ColumnDataSource(data={'x': ol_cats.tolist(), 'y': ol_pts})
+        plt.scatter(x='x', y='y', source=ol_source,
                     marker='o',
                     alpha=ol_mk_alpha,
                     fill_color=ol_mk_color,
                     size=ol_mk_size,
                     line_alpha=0)
 
+    #A single source drives all the glyphs of the box
+    source = dataSource({'x': x_cats, 'q1': q1, 'q2': q2, 'q3': q3,
+                         'qmin': qmin, 'qmax': qmax}, source)
+
     #Generate the main box
     # Create the lower box between Q1 and Q2
-    plt.vbar(x=x_cats, width=box_width, bottom=q1, top=q2,
+    plt.vbar(x='x', width=box_width, bottom='q1', top='q2', source=source,
              line_width=box_line_width, line_color=box_line_color,
              fill_color=box_low_fill, fill_alpha=box_alpha_fill)
 
     # Mark the median
-    plt.vbar(x=x_cats, width=box_width, bottom=q2, top=q3,
+    plt.vbar(x='x', width=box_width, bottom='q2', top='q3', source=source,
              line_width=box_line_width, line_color=box_line_color,
              fill_color=box_top_fill, fill_alpha=box_alpha_fill)
 
     # Genertare the whiskers
     # Mark the bottom limit
-    plt.vbar(x=x_cats, width=wsk_limits_width, bottom=qmin, top=qmin,
-             line_width=wsk_line_width, line_color=wsk_color,
+    plt.vbar(x='x', width=wsk_limits_width, bottom='qmin', top='qmin',
+             source=source, line_width=wsk_line_width, line_color=wsk_color,
              fill_color=wsk_color)
     # Mark the top of the segment
-    plt.vbar(x=x_cats, width=wsk_limits_width, bottom=qmax, top=qmax,
-             line_width=wsk_line_width, line_color=wsk_color,
+    plt.vbar(x='x', width=wsk_limits_width, bottom='qmax', top='qmax',
+             source=source, line_width=wsk_line_width, line_color=wsk_color,
              fill_color=wsk_color)
 
-    # Generate the multiplot lines for the whiskers
-    xs_cats = [[x_cat, x_cat] for x_cat in x_cats]
-    ys_whsk_top = [[q3[i], qmax[i]] for i in range(0, len(q3))]
-    ys_whsk_bot = [[qmin[i], q1[i]] for i in range(0, len(q3))]
-
-    plt.multi_line(xs=xs_cats, ys=ys_whsk_top,
-                   line_width=wsk_line_width, color=wsk_color)
-    plt.multi_line(xs=xs_cats, ys=ys_whsk_bot,
-                   line_width=wsk_line_width, color=wsk_color)
-
-
+    # Generate the whiskers lines as segments
+    plt.segment(x0='x', y0='q3', x1='x', y1='qmax', source=source,
+                line_width=wsk_line_width, color=wsk_color)
+    plt.segment(x0='x', y0='qmin', x1='x', y1='q1', source=source,
+                line_width=wsk_line_width, color=wsk_color)
 
     # Return the figure object
     return plt
@@ -276,12 +593,15 @@ def plotBoxPlot(x_cats,q1,q2,q3,qmin,qmax,OL,
 def plotBarBoxPlot(table,plt_size,tstr,plt=None,
                          bar_color=['#90EE90','#20B2AA'],
                          plot_ol = False,
+                         ol_mode='points',
+                         ol_bins=20,
                          box_alpha_fill=1,
                          box_width=0.5,
                          wsk_limits_width=0.15,
                          ol_mk_alpha=0.3,
                          ol_mk_color='black',
-                         ol_mk_size=10):
+                         ol_mk_size=10,
+                         ol_mk_min=3):
     """
      This function takes a pandasdf with the following schema:
        CAT | MAX_VAL | AVG  | Q1 | Q2 | Q3| ICQ |Qmax | Qmin | [OL]
@@ -301,16 +621,16 @@ def plotBarBoxPlot(table,plt_size,tstr,plt=None,
                
     """
 
-    #Parse input table to variables
+    #Parse input table to variables, the values are kept as numpy arrays
     x_cats = table.iloc[:,0].tolist()
-    y_bar1 = table.iloc[:,1].tolist()
-    y_bar2 = table.iloc[:,2].tolist()
-    q1     = table.iloc[:,3].tolist()
-    q2     = table.iloc[:,4].tolist()
-    q3     = table.iloc[:,5].tolist()
-    icq    = table.iloc[:,6].tolist()
-    qmax   = table.iloc[:,7].tolist()
-    qmin   = table.iloc[:,8].tolist()
+    y_bar1 = table.iloc[:,1].values
+    y_bar2 = table.iloc[:,2].values
+    q1     = table.iloc[:,3].values
+    q2     = table.iloc[:,4].values
+    q3     = table.iloc[:,5].values
+    icq    = table.iloc[:,6].values
+    qmax   = table.iloc[:,7].values
+    qmin   = table.iloc[:,8].values
     OL     = table.iloc[:,9].tolist()
 
     #Generate a figure to add the plots
@@ -329,18 +649,23 @@ def plotBarBoxPlot(table,plt_size,tstr,plt=None,
                        title=tstr)
 
 
+    #Bars and box share the same data source
+    source = ColumnDataSource(data={'x': x_cats})
+
     #Generate the overlay boxPlot
     plt = plotHBarOver(plt=plt, #Pass the figure handler to add the plots
-                       xs=x_cats,width=0.5,ys_bot=[[0]*len(x_cats),[0]*len(x_cats)],
-                       ys_top=[y_bar1,y_bar2],alpha=[1, 0.7],color=bar_color)
+                       xs=x_cats,width=0.5,ys_bot=[np.zeros(len(x_cats))]*2,
+                       ys_top=[y_bar1,y_bar2],alpha=[1, 0.7],color=bar_color,
+                       source=source)
 
     #Create
-    plt = plotBoxPlot(plt=plt, #Pass the figure handler to add the plots
+    plt = plotBoxPlot(plt=plt, source=source, #Pass the figure handler to add the plots
                       x_cats=x_cats, q1=q1,q2=q2,q3=q3,qmin=qmin,qmax=qmax,OL=OL,
-                      plot_ol=plot_ol,
+                      plot_ol=plot_ol,ol_mode=ol_mode,ol_bins=ol_bins,
                       box_width=box_width,box_alpha_fill=box_alpha_fill,
                       wsk_limits_width=wsk_limits_width,
                       ol_mk_alpha=ol_mk_alpha,
                       ol_mk_color=ol_mk_color,
-                      ol_mk_size=ol_mk_size)
+                      ol_mk_size=ol_mk_size,
+                      ol_mk_min=ol_mk_min)
     return plt
\ No newline at end of file
@@ -36,11 +36,14 @@ if __name__ == "__main__":
     sc.setLogLevel('ERROR')
 
     #Add python module
+    sc.addPyFile('quantileSketch.py')
     sc.addPyFile('boxParms.py')
-    from boxParms import boxPerKey
+    from boxParms import boxPerKey, saveBoxParams
 
     df = sqlContext.sql("SELECT app_str, pm FROM postnl_struct.srvchecks_mem")
     df_s1 = df.sample(False,0.001,25) #Sample the data
-    box_prms = boxPerKey(df_s1,0,1)
+    box_prms = boxPerKey(df_s1,0,1,mode='group')
     box_prms.show()
+    #Stored in Parquet, it is loaded by the ploting scripts
+    saveBoxParams(box_prms,'boxPlots.parquet')
 
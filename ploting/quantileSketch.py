@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Mergeable quantile sketch used to compute approximated box plot parameters
+without keeping all the values of a key in memory.
+
+The sketch is a t-digest: the values are summarised by a sorted list of
+centroids (mean, weight). Centroids near the tails hold few values while the
+ones near the median hold many, following the k1 scale function
+    k(q) = compression/(2 pi) * asin(2q - 1)
+Two centroids are only merged when they fall in the same unit of k, hence the
+number of centroids is bounded by the compression and not by the number of
+values added.
+
+Besides the centroids the sketch keeps the exact count, minimum, maximum and
+the nExt smallest and largest values, which are used to report exact whiskers
+and outliners when they are among the extremes.
+
+Digests built in different partitions can be merged in any order, which
+allows to use them with combineByKey/reduceByKey.
+
+@author: julia.delos
+"""
+import numpy as np
+
+
+def compressionForError(rankErr):
+    """
+    Returns the compression needed so that the rank error of the quantiles
+    around the median is below rankErr (given as a fraction of the number of
+    values, e.g 0.01 --> 1%). The error is much smaller close to the tails.
+    """
+    if rankErr <= 0 or rankErr >= 1:
+        raise ValueError("rankErr has to be in the range (0,1)")
+    return int(np.ceil(np.pi / (2.0 * rankErr)))
+
+
+class TDigest(object):
+    """
+    Mergeable t-digest sketch.
+    Input arguments:
+        compression --> Controls the size and the accuracy of the digest.
+                        The number of centroids is about compression/2.
+        nExt        --> Number of exact smallest and largest values kept.
+                        Default 0.
+    """
+
+    def __init__(self, compression=100, nExt=0):
+        self.compression = float(compression)
+        self.nExt = int(nExt)
+        self.n = 0
+        self.vmin = np.inf
+        self.vmax = -np.inf
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.low = np.empty(0)
+        self.high = np.empty(0)
+        #Values not yet merged in the centroids, its size is bounded
+        self._buf = []
+        self._bufSize = int(5 * compression)
+
+    def add(self, x):
+        """Adds a single value to the digest."""
+        self._buf.append(x)
+        if len(self._buf) >= self._bufSize:
+            self._flush()
+        return self
+
+    def update(self, values):
+        """Adds all the values in the iterable values."""
+        for x in values:
+            self.add(x)
+        return self
+
+    def merge(self, other):
+        """Merges the digest other into this one and returns this digest."""
+        self._flush()
+        other._flush()
+        if other.n == 0:
+            return self
+        self.n += other.n
+        self.vmin = min(self.vmin, other.vmin)
+        self.vmax = max(self.vmax, other.vmax)
+        self._compress(np.concatenate((self.means, other.means)),
+                       np.concatenate((self.weights, other.weights)))
+        self._keepExtremes(np.concatenate((self.low, other.low)),
+                           np.concatenate((self.high, other.high)))
+        return self
+
+    def _flush(self):
+        #Merges the buffered values in the centroids
+        if not self._buf:
+            return
+        v = np.asarray(self._buf, dtype=float)
+        self._buf = []
+        self.n += v.size
+        self.vmin = min(self.vmin, v.min())
+        self.vmax = max(self.vmax, v.max())
+        self._compress(np.concatenate((self.means, v)),
+                       np.concatenate((self.weights, np.ones(v.size))))
+        self._keepExtremes(np.concatenate((self.low, v)),
+                           np.concatenate((self.high, v)))
+
+    def _keepExtremes(self, low, high):
+        k = self.nExt
+        if k == 0:
+            return
+        if low.size > k:
+            low = np.partition(low, k - 1)[:k]
+        if high.size > k:
+            high = np.partition(high, high.size - k)[-k:]
+        self.low = np.sort(low)
+        self.high = np.sort(high)
+
+    def _compress(self, means, weights):
+        # Sort the centroids and group all the ones falling in the same
+        # unit of the scale function k(q). Fully vectorised.
+        order = np.argsort(means, kind='mergesort')
+        means = means[order]
+        weights = weights[order]
+        cum = np.cumsum(weights)
+        q = (cum - weights / 2.0) / cum[-1]
+        k = self.compression / (2 * np.pi) * np.arcsin(2 * q - 1)
+        bucket = np.floor(k)
+        starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+        w = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / w
+        self.weights = w
+
+    def _centers(self):
+        # Rank (0 based) of the centre of each centroid, with the exact
+        # minimum and maximum added as end points.
+        cum = np.cumsum(self.weights)
+        centers = cum - self.weights / 2.0 - 0.5
+        return (np.r_[0.0, centers, self.n - 1.0],
+                np.r_[self.vmin, self.means, self.vmax])
+
+    def quantile(self, q):
+        """
+        Returns the estimated q quantile (q in [0,1]) using the same linear
+        interpolation between ranks as numpy.percentile. q can be an array.
+        """
+        self._flush()
+        if self.n == 0:
+            raise ValueError("quantile of an empty digest")
+        ranks, values = self._centers()
+        return np.interp(np.asarray(q) * (self.n - 1), ranks, values)
+
+    def rank(self, x):
+        """Returns the estimated number of values smaller than x."""
+        self._flush()
+        ranks, values = self._centers()
+        r = np.interp(x, values, ranks, left=-1.0, right=self.n - 0.5)
+        return np.clip(np.ceil(r), 0, self.n)
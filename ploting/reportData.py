@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+Loading of the tables used by the memory performance reports.
+
+The box parameters computed by boxParms.boxPerKey are stored in Parquet
+(boxParms.saveBoxParams) and the services memory table (tmem) in Arrow IPC
+files. Both are columnar binary formats where the outliners are a native list
+column, so there is no need to reparse them from strings. The files are memory
+mapped and converted to pandas without copying the values one by one.
+
+The old csv files are still accepted: tmem.csv is converted to the Arrow file
+tmem.arrow the first time it is read and boxPlots.csv is parsed as before.
+
+loadReportTable builds the merged table used by the performance plots and
+caches it on disk, so the reports are regenerated without loading and
+merging the sources again while they do not change.
+
+loadReportPage loads the merged rows of a few services only, reading just
+their row groups from the Parquet files, and keeps the last pages used in a
+LRU cache keyed by the contents of the sources, so the pages are reloaded
+when the files are regenerated. It is used by the dashboard boxPlotApp.py.
+
+@author: julia.delos
+"""
+import hashlib
+import json
+import os
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+#Box parameters columns with values in the units of the measures
+boxValCols = ['Q1','Q2','Q3','IQR','Qmax','Qmin']
+
+#Columns of the table used by ploting_lib.plotBarBoxPlot, plus the VM type
+reportCols = ['SrvNameInst','tpmGb','avgGb','Q1','Q2','Q3','IQR','Qmax','Qmin',
+              'OL','type']
+
+#Version of the report table format, changing it invalidates the caches
+reportVersion = 1
+
+
+def readArrowTable(path):
+    """
+    Reads an Arrow IPC file (.arrow or .feather) or a Parquet file or
+    directory (as written by spark) as an Arrow table, memory mapping it.
+    """
+    if path.endswith('.arrow') or path.endswith('.feather'):
+        with pa.memory_map(path) as src:
+            return pa.ipc.open_file(src).read_all()
+    return pq.read_table(path, memory_map=True)
+
+
+def writeArrowTable(table, path):
+    """Writes the Arrow table (or pandas data frame) to an Arrow IPC file."""
+    if isinstance(table, pd.DataFrame):
+        table = pa.Table.from_pandas(table, preserve_index=False)
+    with pa.OSFile(path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+def scaleList(col, factor):
+    """
+    Divides all the values of the list column col by factor, working on the
+    flat values array of the column instead of each list.
+    """
+    col = col.combine_chunks() if isinstance(col, pa.ChunkedArray) else col
+    offsets = pc.subtract(col.offsets, col.offsets[0])
+    return pa.ListArray.from_arrays(offsets, pc.divide(col.flatten(), factor))
+
+
+def readBoxParams(path, scale=1024.0, keys=None):
+    """
+    Loads the box parameters generated by boxPerKey as a pandas data frame.
+    All the values, outliners included, are divided by scale (default
+    1024, MB to GB). The OL column contains a numpy array per row.
+    path can be a Parquet/Arrow file or the legacy csv file, where OL is a
+    string with the list of outliners.
+    With keys only the rows of these keys are loaded, a Parquet file only
+    reads the row groups whose statistics may contain them.
+    """
+    if path.endswith('.csv'):
+        boxPrms = pd.read_csv(path)
+        if keys is not None:
+            boxPrms = boxPrms[boxPrms['key'].isin(keys)].reset_index(drop=True)
+        ol = boxPrms['OL'].fillna('[]').str.strip('[]')
+        boxPrms['OL'] = [np.array(v.split(','), dtype=float) / scale if v
+                         else np.empty(0) for v in ol]
+    else:
+        if keys is None:
+            table = readArrowTable(path)
+        elif path.endswith('.arrow') or path.endswith('.feather'):
+            table = readArrowTable(path)
+            table = table.filter(pc.is_in(table.column('key'),
+                                          value_set=pa.array(list(keys), pa.string())))
+        else:
+            table = pq.read_table(path, memory_map=True,
+                                  filters=[('key', 'in', list(keys))])
+        idx = table.schema.get_field_index('OL')
+        table = table.set_column(idx, 'OL', scaleList(table.column('OL'), scale))
+        boxPrms = table.to_pandas()
+    boxPrms[boxValCols] = boxPrms[boxValCols] / scale
+    return boxPrms
+
+
+def readTmem(path):
+    """
+    Loads the services memory table. A csv file is converted to an Arrow
+    file with the same name and .arrow extension, which is used instead of
+    the csv file while it is not older than it.
+    """
+    if path.endswith('.csv'):
+        arrowPath = os.path.splitext(path)[0] + '.arrow'
+        if (not os.path.exists(arrowPath) or
+                os.path.getmtime(arrowPath) < os.path.getmtime(path)):
+            writeArrowTable(pd.read_csv(path), arrowPath)
+        path = arrowPath
+    return readArrowTable(path).to_pandas()
+
+
+def sourceFiles(path):
+    # The files of path, a single file or a directory (spark output)
+    if not os.path.isdir(path):
+        return [path]
+    return sorted(os.path.join(root, f) for root, dirs, files in os.walk(path)
+                  for f in files if not f.startswith('.') and not f.startswith('_'))
+
+
+def contentHash(path, manifest):
+    """
+    Returns the sha1 of the contents of path (file or directory). The hash of
+    each file is stored in the dictionary manifest with its modification time
+    and size, and it is only recomputed when any of them changes.
+    """
+    total = hashlib.sha1()
+    for f in sourceFiles(path):
+        st = os.stat(f)
+        entry = manifest.get(f)
+        if entry is None or entry['mtime'] != st.st_mtime or entry['size'] != st.st_size:
+            h = hashlib.sha1()
+            with open(f, 'rb') as fd:
+                for chunk in iter(lambda: fd.read(1 << 20), b''):
+                    h.update(chunk)
+            entry = {'mtime': st.st_mtime, 'size': st.st_size, 'sha1': h.hexdigest()}
+            manifest[f] = entry
+        total.update(entry['sha1'].encode())
+    return total.hexdigest()
+
+
+def readServiceIndex(tmemPath):
+    """
+    Loads the services memory table adding the column
+    type = round(log2(tpmGb/1.75)), which classifies the services by VM size.
+    """
+    tmem = readTmem(tmemPath)
+    tmem['type'] = np.round(np.log2(tmem['tpmGb'] / 1.75)).astype(int)
+    return tmem
+
+
+def mergeReport(tmem, boxPrms):
+    # Joins the services table (with type) and their box parameters
+    tdata = pd.merge(tmem, boxPrms, how='left', left_on='SrvName', right_on='key')
+    tdata['OL'] = tdata['OL'].where(tdata['key'].notnull(), None)
+    return tdata[reportCols].reset_index(drop=True)
+
+
+def buildReportTable(tmemPath, boxPath):
+    """
+    Builds the table used by the performance plots from the services memory
+    table and the box parameters:
+      SrvNameInst | tpmGb | avgGb | Q1 | Q2 | Q3 | IQR | Qmax | Qmin | OL | type
+    where type classifies the services by VM size (see readServiceIndex).
+    Services without box parameters have NaN values and OL None.
+    """
+    return mergeReport(readServiceIndex(tmemPath), readBoxParams(boxPath))
+
+
+#Hashes of the sources of the pages, see contentHash
+pageManifest = {}
+
+
+@lru_cache(maxsize=1)
+def cachedServiceIndex(tmemPath, tmemHash):
+    # readServiceIndex indexed by service, loaded once per contents of tmemPath
+    return readServiceIndex(tmemPath).set_index('SrvName', drop=False)
+
+
+@lru_cache(maxsize=64)
+def cachedReportPage(tmemPath, boxPath, keys, tmemHash, boxHash):
+    # Page of loadReportPage for the given contents of the sources
+    tmem = cachedServiceIndex(tmemPath, tmemHash).loc[list(keys)].reset_index(drop=True)
+    return mergeReport(tmem, readBoxParams(boxPath, keys=keys))
+
+
+def loadReportPage(tmemPath, boxPath, keys):
+    """
+    Returns the rows of buildReportTable for the services in the tuple keys,
+    in the same order, loading only their box parameters. The last 64 pages
+    and the services table are kept in memory, keyed by the hashes of the
+    source files (only recomputed when their modification time or size
+    change). The returned data frame must not be modified.
+    """
+    return cachedReportPage(tmemPath, boxPath, tuple(keys),
+                            contentHash(tmemPath, pageManifest),
+                            contentHash(boxPath, pageManifest))
+
+
+def loadReportTable(tmemPath='tmem.csv', boxPath='boxPlots.parquet', cacheDir=None):
+    """
+    Returns the table built by buildReportTable, cached in cacheDir (default
+    .reportCache next to tmemPath) as an Arrow file. The cache is keyed by the
+    contents of the source files, whose hashes are only recomputed when their
+    modification time or size change, so regenerating the reports with the
+    same sources just memory maps the cached table. The tables of previous
+    sources are removed from cacheDir when a new one is written.
+    """
+    if cacheDir is None:
+        cacheDir = os.path.join(os.path.dirname(os.path.abspath(tmemPath)), '.reportCache')
+    if not os.path.isdir(cacheDir):
+        os.makedirs(cacheDir)
+    manifestPath = os.path.join(cacheDir, 'manifest.json')
+    manifest = {}
+    if os.path.exists(manifestPath):
+        with open(manifestPath) as fd:
+            manifest = json.load(fd)
+
+    key = hashlib.sha1(('%d:%s:%s' % (reportVersion,
+                                      contentHash(tmemPath, manifest),
+                                      contentHash(boxPath, manifest))).encode()).hexdigest()
+    # The entries of the files no longer in the sources are dropped
+    sources = set(sourceFiles(tmemPath) + sourceFiles(boxPath))
+    manifest = dict((f, e) for f, e in manifest.items() if f in sources)
+    with open(manifestPath, 'w') as fd:
+        json.dump(manifest, fd)
+
+    cachePath = os.path.join(cacheDir, 'report_%s.arrow' % key)
+    if os.path.exists(cachePath):
+        return readArrowTable(cachePath).to_pandas()
+    tdata = buildReportTable(tmemPath, boxPath)
+    # Written to a temporary file first, so a broken cache is never read
+    writeArrowTable(tdata, cachePath + '.tmp')
+    os.rename(cachePath + '.tmp', cachePath)
+    # Only the table of the current sources is kept
+    for f in os.listdir(cacheDir):
+        if f.startswith('report_') and f.endswith('.arrow') and f != os.path.basename(cachePath):
+            os.remove(os.path.join(cacheDir, f))
+    return tdata
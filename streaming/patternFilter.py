@@ -0,0 +1,130 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+ Filter of the words of a stream that fully match any of a set of patterns.
+
+ The patterns are broadcast once and compiled once per executor (python worker):
+   - Literal patterns (without regex special characters) are kept in a set, a full
+     match of a literal is just the equality with the word.
+   - The other patterns are combined in a single alternation anchored at the end of
+     the word, so each word is matched once whatever the number of patterns.
+     Patterns with back references or global flags (e.g. '(?i)') are matched
+     one by one, in the alternation their groups would be renumbered and the
+     flags would not be at the start of the expression.
+
+ The module has to be shipped to the executors (sc.addPyFile), so the compiled
+ matchers are kept between the tasks run by the same python worker.
+"""
+import re
+
+#Characters with a special meaning in a regular expression
+reSpecial = set('.^$*+?{}[]\\|()')
+
+#Back references (numbered, named or conditional) of a pattern
+reBackref = re.compile(r'\\\d|\(\?P=|\(\?\(')
+
+#Global inline flags at the start of a pattern
+reGlobalFlags = re.compile(r'\(\?[aiLmsux]+\)')
+
+#Compiled matchers of this python worker, by tuple of patterns
+_matchers = {}
+
+#Broadcast patterns of the driver, by tuple of patterns
+_broadcasts = {}
+
+
+def readPatterns(path):
+    """
+    Reads a patterns file, one pattern per line. Empty lines and lines starting
+    with # are ignored.
+    """
+    with open(path) as fd:
+        lines = [l.rstrip('\r\n') for l in fd]
+    return [l for l in lines if l.strip() and not l.startswith('#')]
+
+
+def isLiteral(pattern):
+    #True when the pattern only matches itself
+    return not reSpecial.intersection(pattern)
+
+
+def compileMatcher(patterns):
+    r"""
+    Returns a function word --> True when the word fully matches any of the
+    patterns. Patterns with back references are matched one by one, as the
+    groups of the previous patterns in the alternation would change their
+    numbers without any error:
+        >>> compileMatcher(('(x)y', r'(a)\1'))('aa')
+        True
+
+    Patterns starting with global flags are matched one by one too, the flags
+    are only valid at the start of the expression:
+        >>> compileMatcher(('(?i)abc', 'x+'))('ABC')
+        True
+
+    If the rest can not be combined in one alternation (e.g. repeated group
+    names) they are matched one by one too.
+    """
+    literals = frozenset(p for p in patterns if isLiteral(p))
+    regexps = [p for p in patterns if not isLiteral(p)]
+    if not regexps:
+        return literals.__contains__
+    alone = lambda p: reBackref.search(p) or reGlobalFlags.match(p)
+    matchers = [re.compile(p).fullmatch for p in regexps if alone(p)]
+    combined = [p for p in regexps if not alone(p)]
+    if combined:
+        try:
+            # \Z anchors the match at the end of the word (fullmatch)
+            matchers.append(re.compile('(?:%s)\\Z' % '|'.join('(?:%s)' % p for p in combined)).match)
+        except (re.error, AssertionError):
+            matchers.extend(re.compile(p).fullmatch for p in combined)
+    return lambda word: word in literals or any(m(word) for m in matchers)
+
+
+def getMatcher(patterns):
+    """Returns the matcher of the tuple patterns, compiled once per worker."""
+    match = _matchers.get(patterns)
+    if match is None:
+        match = _matchers[patterns] = compileMatcher(patterns)
+    return match
+
+
+def getBroadcast(sc, patterns):
+    """
+    Returns the broadcast of the tuple patterns, created the first time it is
+    needed. Broadcasts can not be recovered from a checkpoint, hence they are
+    created lazily by the driver when processing the batches.
+    """
+    bc = _broadcasts.get(patterns)
+    if bc is None:
+        bc = _broadcasts[patterns] = sc.broadcast(patterns)
+    return bc
+
+
+def filterPartition(words, bcPatterns):
+    """Yields the words of the partition fully matching any broadcast pattern."""
+    match = getMatcher(bcPatterns.value)
+    for word in words:
+        if match(word):
+            yield word
+
+
+def filterWords(rdd, patterns):
+    """Returns the words of rdd fully matching any of the tuple patterns."""
+    bc = getBroadcast(rdd.context, patterns)
+    return rdd.mapPartitions(lambda words: filterPartition(words, bc))
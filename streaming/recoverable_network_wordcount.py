@@ -19,9 +19,15 @@
  Counts words in text encoded with UTF8 received from the network every second.
 
  Usage: recoverable_network_wordcount.py <hostname> <port> <checkpoint-directory> <output-file>
+                                         [<sink>]
    <hostname> and <port> describe the TCP server that Spark Streaming would connect to receive
    data. <checkpoint-directory> directory to HDFS-compatible file system which checkpoint data
    <output-file> file to which the word counts will be appended
+   <sink> where the counts are displayed, default 'terminal' (see sinks.py)
+
+ Each line of the output file holds the time of a batch and its counts, separated by a
+ tab. The file is kept open and rotated to <output-file>.1, .2... every 64 MB. The batches
+ replayed after a restart from the checkpoint are not written again.
 
  To run this on your local machine, you need to first run a Netcat server
     `$ nc -lk 9999`
@@ -43,10 +49,7 @@ import sys
 from pyspark import SparkContext
 from pyspark.streaming import StreamingContext
 
-
-#Define clear screen function
-def cls():
-    tmp = os.system('clear')
+from sinks import getSink, getWriter, outputFiles
 
 
 # Get or register a Broadcast variable
@@ -63,12 +66,12 @@ def getDroppedWordsCounter(sparkContext):
     return globals()['droppedWordsCounter']
 
 
-def createContext(host, port, outputPath,checkpointDirectory):
+def createContext(host, port, outputPath,checkpointDirectory, sinkSpec):
     # If you do not see this printed, that means the StreamingContext has been loaded
     # from the new checkpoint
     print("Creating new context! Working in the current path: %s !" % os.getcwd())
-    if os.path.exists(outputPath):
-        os.remove(outputPath)
+    for f in outputFiles(outputPath):
+        os.remove(f)
     sc = SparkContext("local[2]",appName="PythonStreamingRecoverableNetworkWordCount")
     sc.setLogLevel('ERROR')
     ssc = StreamingContext(sc, 1)
@@ -84,34 +87,37 @@ def createContext(host, port, outputPath,checkpointDirectory):
         blacklist = getWordBlacklist(rdd.context)
         # Get or register the droppedWordsCounter Accumulator
         droppedWordsCounter = getDroppedWordsCounter(rdd.context)
-	
+
         # Use blacklist to drop words and use droppedWordsCounter to count them
         def filterFunc(wordCount):
             if wordCount[0] in blacklist.value:
                 droppedWordsCounter.add(wordCount[1])
-                False
+                return False
             else:
-                True
-	# Before printing, clear terminal
-	cls()
-        counts = "Counts at time %s %s" % (time, rdd.filter(filterFunc).collect())
-        print(counts)
-        print("Dropped %d word(s) totally" % droppedWordsCounter.value)
-        print("Appending to " + os.path.abspath(outputPath))
-        with open(outputPath, 'a') as f:
-            f.write(counts + "\n")
+                return True
+
+        counts = rdd.filter(filterFunc).collect()
+        #The display is written by the writer thread of the sink
+        getSink(sinkSpec).emit(time, ["Counts at time %s %s" % (time, counts),
+                                      "Dropped %d word(s) totally" % droppedWordsCounter.value,
+                                      "Appending to " + os.path.abspath(outputPath)])
+        #The output is handed to the OS before the batch completes, without
+        # reopening or syncing the file. Batches already in the file are skipped.
+        getWriter(outputPath, flushSecs=0).write(time, [str(counts)])
 
     wordCounts.foreachRDD(echo)
     ssc.checkpoint(checkpointDirectory)
     return ssc
 
 if __name__ == "__main__":
-    if len(sys.argv) != 5:
+    if len(sys.argv) not in (5, 6):
         print("Usage: recoverable_network_wordcount.py <hostname> <port> "
-              "<checkpoint-directory> <output-file>", file=sys.stderr)
+              "<checkpoint-directory> <output-file> [<sink>]", file=sys.stderr)
         exit(-1)
-    host, port, checkpoint, output = sys.argv[1:]
+    host, port, checkpoint, output = sys.argv[1:5]
+    sinkSpec = sys.argv[5] if len(sys.argv) == 6 else 'terminal'
     ssc = StreamingContext.getOrCreate(checkpoint,
-                                       lambda: createContext(host, int(port), output,checkpoint))
+                                       lambda: createContext(host, int(port), output,checkpoint,
+                                                             sinkSpec))
     ssc.start()
     ssc.awaitTermination()
@@ -0,0 +1,369 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+ Output sinks of the streaming scripts.
+
+ The foreachRDD callbacks only build the text lines of a batch and hand them to an
+ AsyncSink, which puts them in a bounded queue drained by a background writer thread.
+ A slow terminal, disk or socket does not delay the next micro-batch.
+
+ The sinks are given as a comma separated list:
+   terminal             --> Dashboard redrawn in place with ANSI escape codes
+   file:<path>          --> Lines appended to a file
+   socket:<host:port>   --> Lines sent to a tcp listener, e.g. `nc -lk 9998`
+   socket:<path>        --> Lines sent to a unix socket
+ e.g. "terminal,file:counts.txt"
+
+ BatchWriter writes the output of the batches to rotated files, buffered and skipping
+ the batches already written, which are replayed after a restart from a checkpoint.
+"""
+from __future__ import print_function
+
+import atexit
+import os
+import socket
+import sys
+import threading
+import time as clock
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class TerminalSink(object):
+    """
+    Dashboard redrawn in place: the cursor is moved to the top of the screen,
+    each line overwrites the previous one and the rest of the screen is
+    cleared, without forking a shell to clear it.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def write(self, time, lines):
+        out = ['\x1b[H'] + [line + '\x1b[K\n' for line in lines] + ['\x1b[J']
+        self.stream.write(''.join(out))
+        self.stream.flush()
+
+    def close(self):
+        pass
+
+
+class FileSink(object):
+    """Appends the lines of each batch to the file path, kept open."""
+
+    def __init__(self, path):
+        self.fd = open(path, 'a')
+
+    def write(self, time, lines):
+        self.fd.write(''.join(line + '\n' for line in lines))
+        self.fd.flush()
+
+    def close(self):
+        self.fd.close()
+
+
+class SocketSink(object):
+    """
+    Sends the lines of each batch to a local socket, given as 'host:port' or
+    as the path of a unix socket. It connects when needed, the batches
+    produced while nobody is listening are dropped.
+    """
+
+    def __init__(self, address):
+        self.address = address
+        self.sock = None
+
+    def connect(self):
+        if ':' in self.address:
+            host, port = self.address.rsplit(':', 1)
+            return socket.create_connection((host, int(port)))
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.address)
+        return sock
+
+    def write(self, time, lines):
+        data = ''.join(line + '\n' for line in lines).encode('utf-8')
+        try:
+            if self.sock is None:
+                self.sock = self.connect()
+            self.sock.sendall(data)
+        except (IOError, OSError):
+            self.close()
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+class AsyncSink(object):
+    """
+    Writes the batches to the sinks from a background thread.
+    Input arguments:
+        sinks   --> List of sinks, objects with the methods write(time, lines)
+                    and close()
+        maxsize --> Maximum number of batches waiting to be written. Default 8
+        dropOld --> When the queue is full the oldest waiting batch is dropped,
+                    a dashboard only needs the last one. With False emit waits
+                    for the writer and no batch is lost. Default True
+    """
+
+    def __init__(self, sinks, maxsize=8, dropOld=True):
+        self.sinks = sinks
+        self.dropOld = dropOld
+        self.queue = queue.Queue(maxsize)
+        self.thread = threading.Thread(target=self._run, name='sinkWriter')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def emit(self, time, lines):
+        """Hands the lines of the batch of time to the writer thread."""
+        item = (time, list(lines))
+        if not self.dropOld:
+            self.queue.put(item)
+            return
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            for sink in self.sinks:
+                try:
+                    sink.write(*item)
+                except Exception as e:
+                    print("Sink %s failed: %s" % (type(sink).__name__, e), file=sys.stderr)
+        for sink in self.sinks:
+            sink.close()
+
+    def close(self, timeout=10):
+        """Writes the waiting batches and closes the sinks."""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout)
+
+
+def openSink(spec, maxsize=8, dropOld=None):
+    """
+    Returns an AsyncSink writing to the sinks of the comma separated list
+    spec. By default the old batches are only dropped when there is no file
+    sink.
+    """
+    sinks = []
+    for item in spec.split(','):
+        kind, _, arg = item.strip().partition(':')
+        if kind == 'terminal':
+            sinks.append(TerminalSink())
+        elif kind == 'file' and arg:
+            sinks.append(FileSink(arg))
+        elif kind == 'socket' and arg:
+            sinks.append(SocketSink(arg))
+        else:
+            raise ValueError("Unknown sink '%s'" % item)
+    if dropOld is None:
+        dropOld = not any(isinstance(s, FileSink) for s in sinks)
+    return AsyncSink(sinks, maxsize, dropOld)
+
+
+def batchKey(time):
+    # Milliseconds since the epoch of a batch time (naive local datetime given
+    # to foreachRDD). Unlike the local time text it does not go back when the
+    # clocks are set back at the end of the summer time
+    if hasattr(time, 'timetuple'):
+        return int(clock.mktime(time.timetuple()) * 1000) + time.microsecond // 1000
+    return int(time)
+
+
+def outputFiles(path):
+    """
+    Returns the output files of a BatchWriter, the rotated files path.1,
+    path.2... from the oldest, plus path if it exists.
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    prefix = os.path.basename(path) + '.'
+    nums = sorted(int(f[len(prefix):]) for f in os.listdir(folder)
+                  if f.startswith(prefix) and f[len(prefix):].isdigit())
+    files = ['%s.%d' % (path, n) for n in nums]
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+def lastBatch(path, block=1 << 16):
+    """
+    Returns the batch key of the last line of the file path, None if it is
+    empty (the milliseconds since the epoch, see batchKey). A last line
+    without end of line, left by a crash while writing,
+    is removed from the file.
+    """
+    with open(path, 'rb+') as fd:
+        fd.seek(0, 2)
+        size = fd.tell()
+        # The end of the file, read until it holds a complete line
+        pos = size
+        data = b''
+        while pos > 0 and data.count(b'\n') < 2:
+            start = max(0, pos - block)
+            fd.seek(start)
+            data = fd.read(pos - start) + data
+            pos = start
+        cut = data.rfind(b'\n') + 1
+        if pos + cut < size:
+            fd.truncate(pos + cut)
+        if cut == 0:
+            return None
+        return int(data[:cut].split(b'\n')[-2].split(b'\t', 1)[0])
+
+
+class BatchWriter(object):
+    """
+    Buffered and idempotent writer of the output of the batches, with the
+    interface of the sinks. Each line is written as "<batch time>\t<line>",
+    with the batch time in milliseconds since the epoch (see batchKey).
+    When it is opened the time of the last batch written is read from the
+    output files and the batches up to that time are skipped, so the batches
+    replayed after a restart from the checkpoint are not written twice. The
+    later batches are always written, they are only compared with that time.
+    Input arguments:
+        path       --> Output file. When it reaches maxBytes it is renamed to
+                       path.<n> and a new one is started
+        flushBytes --> The buffered batches are written when they reach this
+                       size in bytes. Default 64 KB
+        flushSecs  --> or when the oldest one is this old, checked when a batch
+                       is written. 0 writes every batch. Default 5 s
+        fsync      --> 'always' syncs the file after every write, 'rotate' when
+                       a file is completed or closed, 'never'. Default 'rotate'
+        maxBytes   --> Maximum size of the files. None, no rotation. Default 64 MB
+    The batches still in the buffer are lost if the driver dies, use
+    flushSecs=0 for exactly once output. The written lines are only safe from a
+    crash of the machine after a sync.
+    """
+
+    def __init__(self, path, flushBytes=1 << 16, flushSecs=5.0, fsync='rotate',
+                 maxBytes=1 << 26):
+        if fsync not in ('always', 'rotate', 'never'):
+            raise ValueError("fsync has to be 'always', 'rotate' or 'never'")
+        self.path = path
+        self.flushBytes = flushBytes
+        self.flushSecs = flushSecs
+        self.fsync = fsync
+        self.maxBytes = maxBytes
+        self.lastKey = None
+        for f in reversed(outputFiles(path)):
+            self.lastKey = lastBatch(f)
+            if self.lastKey is not None:
+                break
+        self.fd = open(path, 'ab')
+        self.size = os.path.getsize(path)
+        self.buf = []
+        self.bufBytes = 0
+        self.bufTime = None
+
+    def write(self, time, lines):
+        key = batchKey(time)
+        if self.lastKey is not None and key <= self.lastKey:
+            # Already written before the restart, lastKey is not moved by the
+            # batches written since then
+            return
+        data = ''.join('%s\t%s\n' % (key, line) for line in lines)
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        if data:
+            self.buf.append(data)
+            self.bufBytes += len(data)
+            if self.bufTime is None:
+                self.bufTime = clock.time()
+        if self.buf and (self.bufBytes >= self.flushBytes or
+                         clock.time() - self.bufTime >= self.flushSecs):
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered batches to the file."""
+        if not self.buf:
+            return
+        data = b''.join(self.buf)
+        self.buf = []
+        self.bufBytes = 0
+        self.bufTime = None
+        if self.maxBytes and self.size > 0 and self.size + len(data) > self.maxBytes:
+            self.rotate()
+        self.fd.write(data)
+        self.fd.flush()
+        self.size += len(data)
+        if self.fsync == 'always':
+            os.fsync(self.fd.fileno())
+
+    def rotate(self):
+        """Renames the current file to path.<n> and starts a new one."""
+        if self.fsync != 'never':
+            os.fsync(self.fd.fileno())
+        self.fd.close()
+        rotated = outputFiles(self.path)[:-1]
+        n = int(rotated[-1].rsplit('.', 1)[1]) + 1 if rotated else 1
+        os.rename(self.path, '%s.%d' % (self.path, n))
+        self.fd = open(self.path, 'ab')
+        self.size = 0
+
+    def close(self):
+        if self.fd.closed:
+            return
+        self.flush()
+        if self.fsync != 'never':
+            os.fsync(self.fd.fileno())
+        self.fd.close()
+
+
+#Sinks of the driver, by spec
+_sinks = {}
+
+
+def getSink(spec):
+    """
+    Returns the AsyncSink of spec, opened the first time it is needed and
+    closed at exit. Like the broadcasts, the sinks are created lazily by the
+    driver, as they can not be saved in the checkpoint with the callbacks.
+    """
+    sink = _sinks.get(spec)
+    if sink is None:
+        sink = _sinks[spec] = openSink(spec)
+        atexit.register(sink.close)
+    return sink
+
+
+def getWriter(path, **kwargs):
+    """
+    Returns the BatchWriter of path, opened the first time it is needed and
+    closed at exit. kwargs are the arguments of BatchWriter.
+    """
+    writer = _sinks.get(('writer', path))
+    if writer is None:
+        writer = _sinks[('writer', path)] = BatchWriter(path, **kwargs)
+        atexit.register(writer.close)
+    return writer
@@ -0,0 +1,138 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+ Computes the box plot statistics per key of the measures received from the
+ network every second, using a defined time window and interval.
+
+ Usage: windowed_boxplot.py <hostname> <port> <checkpoint-directory> <window-length>
+                            <window-interval> [<rank-error> [<sink>]]
+
+   <hostname> and <port> describe the TCP server that Spark Streaming would connect to receive
+   data. Each line has to contain a key and a value separated by spaces, e.g. "PAK 2048".
+   <checkpoint-directory> directory to HDFS-compatible file system which checkpoint data
+   <window-length> is the lenght of the window that the streaming msg are processed
+   <window-int> is the interval that the window is refreshed
+   <rank-error> is the error bound of the quartiles, default 0.01
+   <sink> where the statistics are displayed, default 'terminal' (see sinks.py)
+
+ Each batch is summarised per key with a mergeable TDigest (ploting/quantileSketch.py),
+ the window merges the digests of its batches, so the memory does not depend on the
+ number of measures received. For each key the quartiles, the whiskers and the estimated
+ number of outliners are displayed every window interval.
+
+ To run this on your local machine, you need to first run a Netcat server
+    `$ nc -lk 9999`
+
+ and then run the example
+    `$ bin/spark-submit --master local[2] windowed_boxplot.py localhost 9999 ~/checkpoint/ 30 2`
+"""
+from __future__ import print_function
+
+import os
+import sys
+
+from pyspark import SparkContext
+from pyspark.streaming import StreamingContext
+
+from sinks import getSink
+
+# The box parameters modules live in the ploting folder
+plotingDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ploting')
+sys.path.insert(0, plotingDir)
+from quantileSketch import TDigest, compressionForError
+from boxParms import boxParamsSketch, sketchOutlierCount
+
+
+#Parse a line "key value" into a (key, value) pair, None if it is not valid
+def parseMeasure(line):
+    fields = line.split()
+    if len(fields) != 2:
+        return None
+    try:
+        return (fields[0], float(fields[1]))
+    except ValueError:
+        return None
+
+
+#Box statistics of a digest: box parameters plus the estimated number of outliners
+def boxStats(d):
+    Q1, Q2, Q3, IQR, Qmax, Qmin, OL = boxParamsSketch(d)
+    return [d.n, Q1, Q2, Q3, Qmin, Qmax, sketchOutlierCount(d, Q1, Q3)]
+
+
+def createContext(host, port, checkpointDirectory, wd_length, wd_int, rankErr, sinkSpec):
+    # If you do not see this printed, that means the StreamingContext has been loaded
+    # from the new checkpoint
+    print("Creating new context! Working in the current path: %s !" % os.getcwd())
+    sc = SparkContext(appName="PythonStreamingWindowedBoxPlot")
+    sc.setLogLevel('ERROR')
+    ssc = StreamingContext(sc, 1)
+
+    comp = compressionForError(rankErr)
+    lines = ssc.socketTextStream(host, port)
+    measures = lines.map(parseMeasure).filter(lambda x: x is not None)
+    # One digest per key and batch, built on the map side
+    digests = measures.combineByKey(lambda v: TDigest(comp, comp).add(v),
+                                    lambda d, v: d.add(v),
+                                    lambda d1, d2: d1.merge(d2))
+    # Digests are not invertible, hence the window merges the per-batch digests
+    # (no inverse reduce function)
+    boxes = digests.reduceByKeyAndWindow(lambda d1, d2: d1.merge(d2), None,
+                                         wd_length, wd_int)
+
+    def echo(time, rdd):
+        #This function is executed for each recieved RDD
+        # and is used to update the displayed results
+        lst = sorted(rdd.mapValues(boxStats).collect())
+        lines = ["------------------------------------------------------------------------",
+                 "Time: %s. Keys: %s" % (time, len(lst)),
+                 "------------------------------------------------------------------------",
+                 "%-20s %8s %9s %9s %9s %9s %9s %6s" %
+                 ('key', 'N', 'Q1', 'Q2', 'Q3', 'Qmin', 'Qmax', 'OL')]
+        lines += ["%-20s %8d %9.2f %9.2f %9.2f %9.2f %9.2f %6d" % tuple([key] + st)
+                  for key, st in lst]
+        #The lines are written by the writer thread of the sink
+        getSink(sinkSpec).emit(time, lines)
+
+    boxes.foreachRDD(echo)
+    ssc.checkpoint(checkpointDirectory)
+    return ssc
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (6, 7, 8):
+        print("Usage: windowed_boxplot.py <hostname> <port> "
+              "<checkpoint-directory> <window length [s]> <window interval [s]> "
+              "[<rank error> [<sink>]]", file=sys.stderr)
+        exit(-1)
+    host, port, checkpoint, wd_len, wd_int = sys.argv[1:6]
+    rankErr = float(sys.argv[6]) if len(sys.argv) >= 7 else 0.01
+    sinkSpec = sys.argv[7] if len(sys.argv) == 8 else 'terminal'
+    ssc = StreamingContext.getOrCreate(checkpoint,
+                                       lambda: createContext(host,
+                                                             int(port),
+                                                             checkpoint,
+                                                             int(wd_len),
+                                                             int(wd_int),
+                                                             rankErr,
+                                                             sinkSpec))
+    # The modules are shipped here and not in createContext, a context
+    # restored from the checkpoint needs them to unpickle the digests too
+    ssc.sparkContext.addPyFile(os.path.join(plotingDir, 'quantileSketch.py'))
+    ssc.sparkContext.addPyFile(os.path.join(plotingDir, 'boxParms.py'))
+    ssc.start()
+    ssc.awaitTermination()
@@ -23,6 +23,9 @@
    data. <checkpoint-directory> directory to HDFS-compatible file system which checkpoint data
    <output-file> file to which the word counts will be appended
 
+ The counts are displayed through the sinks of the optional last argument <sink>,
+ default 'terminal', e.g. 'terminal,file:counts.txt' (see sinks.py).
+
  To run this on your local machine, you need to first run a Netcat server
     `$ nc -lk 9999`
 
@@ -43,10 +46,7 @@ import sys
 from pyspark import SparkContext
 from pyspark.streaming import StreamingContext
 
-
-#Define clear screen function
-def cls():
-    tmp = os.system('clear')
+from sinks import getSink
 
 
 # Get or register a Broadcast variable
@@ -63,7 +63,7 @@ def getDroppedWordsCounter(sparkContext):
     return globals()['droppedWordsCounter']
 
 
-def createContext(host, port, checkpointDirectory):
+def createContext(host, port, checkpointDirectory, sinkSpec):
     # If you do not see this printed, that means the StreamingContext has been loaded
     # from the new checkpoint
     print("Creating new context! Working in the current path: %s !" % os.getcwd())
@@ -79,20 +79,14 @@ def createContext(host, port, checkpointDirectory):
     wordCounts = pairs.reduceByKey(lambda x, y: x + y)
 
     def echo(time, rdd):
-        # Before printing, clear terminal
-        cls()
         n_elem = rdd.count()
-
-        print("-------------------------------------------")
-        print("Time: %s. Processed words: %s" % (time,n_elem))
-        print("-------------------------------------------")
         lst = rdd.collect()
-        if n_elem > 10:
-            for elem in lst[:10]:
-                print("%s=> %s"%(elem[0],elem[1]))
-        elif n_elem > 0:
-            for elem in lst:
-                print("%s=> %s"%(elem[0],elem[1]))
+        lines = ["-------------------------------------------",
+                 "Time: %s. Processed words: %s" % (time,n_elem),
+                 "-------------------------------------------"]
+        lines += ["%s=> %s"%(elem[0],elem[1]) for elem in lst[:10]]
+        #The lines are written by the writer thread of the sink
+        getSink(sinkSpec).emit(time, lines)
 
 
     wordCounts.foreachRDD(echo)
@@ -100,12 +94,14 @@ def createContext(host, port, checkpointDirectory):
     return ssc
 
 if __name__ == "__main__":
-    if len(sys.argv) != 4:
+    if len(sys.argv) not in (4, 5):
         print("Usage: recoverable_network_wordcount.py <hostname> <port> "
-              "<checkpoint-directory> ", file=sys.stderr)
+              "<checkpoint-directory> [<sink>]", file=sys.stderr)
         exit(-1)
-    host, port, checkpoint  = sys.argv[1:]
+    host, port, checkpoint  = sys.argv[1:4]
+    sinkSpec = sys.argv[4] if len(sys.argv) == 5 else 'terminal'
     ssc = StreamingContext.getOrCreate(checkpoint,
-                                       lambda: createContext(host, int(port), checkpoint))
+                                       lambda: createContext(host, int(port), checkpoint,
+                                                             sinkSpec))
     ssc.start()
     ssc.awaitTermination()
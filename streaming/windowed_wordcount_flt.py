@@ -20,15 +20,20 @@
  defined time window and interval.
 
  Usage: recoverable_network_wordcount.py <hostname> <port> <checkpoint-directory> <window-length>
-                                         <window-interval> <regular-expression> 
+                                         <window-interval> <regular-expression|patterns-file> [<sink>]
 
    <hostname> and <port> describe the TCP server that Spark Streaming would connect to receive
    data. <checkpoint-directory> directory to HDFS-compatible file system which checkpoint data
    <window-length> is the lenght of the window that the streaming msg are processed
    <window-int> is the interval that the window is refreshed
    <regular-expression> is a python compatible regex used to filter the msgs
+   <patterns-file> instead of a regex, a file with one regex or word per line. The words
+   fully matching any of the patterns are counted (see patternFilter.py)
  
 
+ The counts are displayed through the sinks of the optional last argument <sink>,
+ default 'terminal', e.g. 'terminal,file:counts.txt' (see sinks.py).
+
  To run this on your local machine, you need to first run a Netcat server
     `$ nc -lk 9999`
  To generate some more intense trafic you can use the /var/log/syslog by running 
@@ -45,33 +50,36 @@
 """
 from __future__ import print_function
 
+import heapq
 import os
 import sys
-import re
+from operator import itemgetter
 
 from pyspark import SparkContext
 from pyspark.streaming import StreamingContext
 
+from sinks import getSink
+
+from patternFilter import filterWords, readPatterns
+
 
-#Define clear screen function
-def cls():
-    tmp = os.system('clear')
+#Number of words displayed
+n_top = 25
 
 
-#Define a funciton that returns true when the regular match of the regular expression
-# pattern matches the full string
-def reFullMatch(string,pattern):
-    tmp = re.match(pattern,string)
-    if tmp:
-        if tmp.group(0) == string:
-            return True
-        else:
-            return False
-    else:
-        return False
+#Returns the number of (word, count) pairs of a partition and its n_top most
+# frequent words, keeping only n_top pairs in memory
+def topPartition(pairs):
+    n_elem = [0]
+    def counted():
+        for pair in pairs:
+            n_elem[0] += 1
+            yield pair
+    top = heapq.nlargest(n_top, counted(), key=itemgetter(1))
+    yield (n_elem[0], top)
 
 
-def createContext(host, port, checkpointDirectory, wd_length, wd_int, regexp ):
+def createContext(host, port, checkpointDirectory, wd_length, wd_int, patterns, sinkSpec ):
     # If you do not see this printed, that means the StreamingContext has been loaded
     # from the new checkpoint
     print("Creating new context! Working in the current path: %s !" % os.getcwd())
@@ -86,8 +94,8 @@ def createContext(host, port, checkpointDirectory, wd_length, wd_int, regexp ):
     # runing tail -f /var/log/syslog | nc host port 
     lines = ssc.socketTextStream(host, port)
     words = lines.flatMap(lambda line: line.split(" "))
-    #Filter words following the regular expression
-    wordsFlt = words.filter(lambda words: reFullMatch(words, regexp ))
+    #Filter words fully matching any of the patterns, compiled once per executor
+    wordsFlt = words.transform(lambda rdd: filterWords(rdd, patterns))
     pairs = wordsFlt.map(lambda x: (x, 1))
     wordCounts = pairs.reduceByKeyAndWindow(lambda x, y: x + y,
                                             lambda x, y: x - y,
@@ -97,21 +105,18 @@ def createContext(host, port, checkpointDirectory, wd_length, wd_int, regexp ):
         #This function is executed for each recieved RDD
         # and is used to update the displayed results
  
-        # Result are sorted by word count, largest on top.
-        rddStr= rdd.sortBy(lambda wordTuple: wordTuple[1],ascending=False)
-        n_elem = rddStr.count()
-        lst = rddStr.collect()
-        #Terminal screen cleaned
-        cls()
-        print("------------------------------------------------")
-        print("Time: %s. Processed words: %s" % (time,n_elem))
-        print("------------------------------------------------")
-        if n_elem > 25:
-            for elem in lst[:25]:
-                print("%s=> %s"%(elem[0],elem[1]))
-        elif n_elem > 0:
-            for elem in lst:
-                print("%s=> %s"%(elem[0],elem[1]))
+        # A single job returns the number of words and the most frequent
+        # words of each partition, merged here. Largest count on top.
+        parts = rdd.mapPartitions(topPartition).collect()
+        n_elem = sum(n for n, top in parts)
+        lst = heapq.nlargest(n_top, (elem for n, top in parts for elem in top),
+                             key=itemgetter(1))
+        lines = ["------------------------------------------------",
+                 "Time: %s. Processed words: %s" % (time,n_elem),
+                 "------------------------------------------------"]
+        lines += ["%s=> %s"%(elem[0],elem[1]) for elem in lst]
+        #The lines are written by the writer thread of the sink
+        getSink(sinkSpec).emit(time, lines)
 
     
     wordCounts.foreachRDD(echo)
@@ -119,18 +124,26 @@ def createContext(host, port, checkpointDirectory, wd_length, wd_int, regexp ):
     return ssc
 
 if __name__ == "__main__":
-    if len(sys.argv) != 7:
+    if len(sys.argv) not in (7, 8):
         print("Usage: recoverable_network_wordcount.py <hostname> <port> "
               "<checkpoint-directory> <window length [s]> <window interval [s]> " 
-"<regular expression>", file=sys.stderr)
+"<regular expression | patterns file> [<sink>]", file=sys.stderr)
         exit(-1)
-    host, port, checkpoint, wd_len, wd_int, regexp  = sys.argv[1:]
+    host, port, checkpoint, wd_len, wd_int, regexp  = sys.argv[1:7]
+    sinkSpec = sys.argv[7] if len(sys.argv) == 8 else 'terminal'
+    #A file of patterns or a single regular expression
+    patterns = tuple(readPatterns(regexp) if os.path.isfile(regexp) else [regexp])
     ssc = StreamingContext.getOrCreate(checkpoint,
                                        lambda: createContext(host, 
                                                              int(port), 
                                                              checkpoint,
                                                              int(wd_len),
                                                              int(wd_int),
-                                                             regexp))
+                                                             patterns,
+                                                             sinkSpec))
+    # The module is shipped here and not in createContext, a context restored
+    # from the checkpoint needs it too
+    ssc.sparkContext.addPyFile(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                            'patternFilter.py'))
     ssc.start()
     ssc.awaitTermination()